@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# bench_hotpath.py
+# micro-benchmarks for the message hot path
+# runs offline against synthetic spaces and stand-in discord objects
+#
+# usage: python3 benchmarks/bench_hotpath.py [--output results.json] [--baseline baseline.json]
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import string
+import sys
+import tempfile
+import time
+
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+# pylint: disable=wrong-import-position
+from deepbluesky import DeepBlueSky
+from deepbluesky.deepbluesky import chunk_message, get_all_noncode_chunks, split_command
+from deepbluesky.fuzzy import NameIndex
+from deepbluesky.space import GuildSpace
+from deepbluesky.text import owoify, spongebob
+from deepbluesky.timeparse import parse_time
+
+# stand-ins for the discord objects the bot touches
+
+class FakePermissions:
+
+    def __init__(self, kick_members: bool):
+        self.kick_members = kick_members
+
+class FakeMember:
+
+    def __init__(self, user_id: int, name: str, moderator: bool = False):
+        self.id = user_id
+        self.name = name
+        self.discriminator = '0'
+        self.display_name = name.capitalize()
+        self.bot = False
+        self.guild_permissions = FakePermissions(moderator)
+
+    def __hash__(self) -> int:
+        return self.id
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, FakeMember) and other.id == self.id
+
+class FakeGuild:
+
+    def __init__(self, guild_id: int, members: List[FakeMember]):
+        self.id = guild_id
+        self.members = members
+        self.chunked = True
+
+    def get_role(self, role_id: int):
+        return None
+
+class FakeChannel:
+
+    def __init__(self, guild: FakeGuild):
+        self.id = guild.id + 1
+        self.guild = guild
+        self.sent = 0
+
+    async def send(self, **kwargs):
+        self.sent += 1
+
+class FakeMessage:
+
+    def __init__(self, author: FakeMember, channel: FakeChannel, content: str):
+        self.id = random.getrandbits(63)
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.content = content
+        self.attachments: List[Any] = []
+        self.reference = None
+
+# synthetic data
+
+def random_name(rng: random.Random, length: int) -> str:
+    return rng.choice(string.ascii_lowercase) + ''.join(rng.choice(string.ascii_lowercase + string.digits + '-_') for _ in range(length - 1))
+
+def synthetic_commands(rng: random.Random, count: int) -> List[Dict[str, Any]]:
+    names = set()
+    while len(names) < count:
+        names.add(random_name(rng, rng.randint(4, 14)))
+    commands = [{'type': 'simple', 'name': name, 'author': rng.getrandbits(60), 'crtime': 1600000000, 'mtime': 1600000000, 'value': 'x' * rng.randint(10, 200)} for name in sorted(names)]
+    # one alias per ten commands
+    aliases = [{'type': 'alias', 'name': f'{command["name"]}-alias', 'author': command['author'], 'crtime': 1600000000, 'mtime': 1600000000, 'value': command['name']} for command in commands[::10]]
+    return commands + aliases
+
+def synthetic_members(rng: random.Random, count: int) -> List[FakeMember]:
+    return [FakeMember(1000 + i, random_name(rng, rng.randint(5, 16))) for i in range(count)]
+
+SAMPLE_MESSAGE = ('hello there [[Some Article]] and `inline [[code]]` and more text\n'
+    '```python\nprint("[[not an article]]")\n```\n'
+    'after the code block [[Another/Article]] with `two` `spans` and [[a third one]]\n') * 4
+
+# plenty of r, l and n for owoify to replace
+OWO_SAMPLE = 'Hello there, I really love learning new languages! Running around in the rain, NO one knows. '
+
+# timing
+
+class Bench:
+
+    def __init__(self, min_time: float, repeat: int):
+        self.min_time = min_time
+        self.repeat = repeat
+        self.results: Dict[str, Dict[str, float]] = {}
+
+    def _record(self, name: str, timings: List[float], number: int):
+        best = min(timings) / number
+        self.results[name] = {'seconds_per_op': best, 'ops_per_second': 1 / best if best else 0.0, 'loops': number}
+        print(f'{name:<48} {best * 1e6:12.3f} us/op')
+
+    def _calibrate(self, run: Callable[[int], float]) -> int:
+        number = 1
+        while True:
+            elapsed = run(number)
+            if elapsed >= self.min_time / self.repeat or number >= 1 << 24:
+                return number
+            number *= 2 if elapsed <= 0 else max(2, min(10, int(self.min_time / self.repeat / elapsed) + 1))
+
+    # for things that can only be done once per input, like loading a space
+    def once(self, name: str, func: Callable[[], Any]):
+        start = time.perf_counter()
+        func()
+        self._record(name, [time.perf_counter() - start], 1)
+
+    def run(self, name: str, func: Callable[[], Any]):
+        def timed(number: int) -> float:
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            return time.perf_counter() - start
+        number = self._calibrate(timed)
+        self._record(name, [timed(number) for _ in range(self.repeat)], number)
+
+    def run_async(self, loop: asyncio.AbstractEventLoop, name: str, func: Callable[[], Awaitable[Any]]):
+        async def timed_async(number: int) -> float:
+            start = time.perf_counter()
+            for _ in range(number):
+                await func()
+            return time.perf_counter() - start
+        def timed(number: int) -> float:
+            return loop.run_until_complete(timed_async(number))
+        number = self._calibrate(timed)
+        self._record(name, [timed(number) for _ in range(self.repeat)], number)
+
+def run_benchmarks(bench: Bench, command_sizes: List[int], member_sizes: List[int]):
+    rng = random.Random(1234)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    # the bot writes its log into the storage directory, so the pipeline is stopped before it is removed
+    with tempfile.TemporaryDirectory(prefix='dbs-bench-') as storage:
+        cwd = os.getcwd()
+        client = DeepBlueSky(bot_name='bench', bot_storage_area=storage, loop_lag_threshold=None)
+        os.chdir(cwd)
+        moderator = FakeMember(1, 'moderator', moderator=True)
+        client._connection.user = FakeMember(2, 'deepbluesky') # pylint: disable=protected-access
+
+        bench.run('split_command', lambda: split_command('createcommand hello some value here'))
+        bench.run('chunk_message', lambda: chunk_message(SAMPLE_MESSAGE, '```'))
+        bench.run('get_all_noncode_chunks', lambda: get_all_noncode_chunks(SAMPLE_MESSAGE))
+        bench.run('owoify', lambda: owoify(SAMPLE_MESSAGE))
+        for size in (200, 2000, 20000):
+            text = (OWO_SAMPLE * (size // len(OWO_SAMPLE) + 1))[:size]
+            bench.run(f'owoify[{size}]', lambda text=text: owoify(text))
+        bench.run('spongebob', lambda: spongebob(SAMPLE_MESSAGE))
+        bench.run('parse_time iso', lambda: parse_time('2024-01-05T10:30:00+02:00'))
+        bench.run('parse_time clock', lambda: parse_time('10:30 EST'))
+        bench.run('parse_time dateutil', lambda: parse_time('Jan 5 2024 3pm EST'))
+
+        for size in command_sizes:
+            command_dicts = synthetic_commands(rng, size)
+            space = GuildSpace(client=client, base_id=10 + size)
+            bench.once(f'load_commands[{size}]', lambda space=space, command_dicts=command_dicts: space.load_commands(command_dicts))
+            names = [command['name'] for command in command_dicts]
+            hit = names[len(names) // 2]
+            alias_name = next(name for name in names if name.endswith('-alias'))
+            bench.run(f'find_command[{size}] builtin', lambda space=space: client.find_command(space, 'help'))
+            bench.run(f'find_command[{size}] custom', lambda space=space, hit=hit: client.find_command(space, hit))
+            bench.run(f'find_command[{size}] miss', lambda space=space: client.find_command(space, 'no-such-command'))
+            index = NameIndex(names)
+            typo = hit[:2] + hit[3:]
+            bench.run(f'NameIndex.search[{size}]', lambda index=index, typo=typo: index.search(typo))
+            alias = space.custom_command_dict[alias_name]
+            bench.run(f'CommandAlias.canonical[{size}]', alias.canonical)
+            guild = FakeGuild(space.base_id, [moderator])
+            space.guild = guild
+            channel = FakeChannel(guild)
+            trigger = FakeMessage(moderator, channel, f'--search {hit[:3]}')
+            bench.run_async(loop, f'search[{size}]', lambda space=space, trigger=trigger, query=hit[:3]: client.search(trigger, space, 'search', query))
+
+        for size in member_sizes:
+            members = synthetic_members(rng, size)
+            guild = FakeGuild(100000 + size, members)
+            space = GuildSpace(client=client, base_id=guild.id)
+            space.guild = guild
+            target = members[len(members) // 2].name
+            bench.run_async(loop, f'query_users[{size}] id', lambda space=space: space.query_users('123456789012345678'))
+            bench.run_async(loop, f'query_users[{size}] name', lambda space=space, target=target: space.query_users(target))
+
+        client.log_pipeline.stop()
+        loop.close()
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], threshold: float) -> List[str]:
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]['seconds_per_op']
+        new = result['seconds_per_op']
+        ratio = new / old if old else float('inf')
+        marker = 'REGRESSION' if ratio > threshold else ''
+        print(f'{name:<48} {old * 1e6:12.3f} -> {new * 1e6:12.3f} us/op  x{ratio:5.2f} {marker}')
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Micro-benchmarks for the Deep Blue Sky message hot path')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='compare against results from an earlier run')
+    parser.add_argument('--threshold', type=float, default=1.25, help='slowdown ratio counted as a regression (default: 1.25)')
+    parser.add_argument('--quick', action='store_true', help='skip the largest inputs and time for less long')
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        bench = Bench(min_time=0.1, repeat=3)
+        run_benchmarks(bench, command_sizes=[10, 1000], member_sizes=[100])
+    else:
+        bench = Bench(min_time=1.0, repeat=5)
+        run_benchmarks(bench, command_sizes=[10, 1000, 100000], member_sizes=[100, 100000])
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': int(time.time()),
+        'results': bench.results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='UTF-8') as json_file:
+            json.dump(report, json_file, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='UTF-8') as json_file:
+            baseline = json.load(json_file)['results']
+        print()
+        regressions = compare(bench.results, baseline, args.threshold)
+        if regressions:
+            print(f'\n{len(regressions)} regressions: {", ".join(regressions)}')
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
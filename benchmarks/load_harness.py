@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# load_harness.py
+# end-to-end load test without touching discord
+#
+# MESSAGE_CREATE payloads are fed to the client's gateway event parsers, so they
+# go through discord.py's own Message construction and event dispatch into
+# DeepBlueSky.handle_message -> Command.invoke -> send_to_channel.
+# The REST side is replaced by an in-process transport that simulates latency
+# and per-channel rate limits, so replies never leave the process.
+#
+# usage: python3 benchmarks/load_harness.py --guilds 200 --rate 500 --duration 30
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+# pylint: disable=wrong-import-position
+import discord
+from deepbluesky import DeepBlueSky
+
+BOT_ID = 1 << 40
+GUILD_BASE = 1 << 50
+USER_BASE = 1 << 45
+
+_snowflakes = itertools.count(1 << 55)
+
+def snowflake() -> str:
+    return str(next(_snowflakes))
+
+def timestamp() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+def user_payload(user_id: int, bot: bool = False) -> Dict[str, Any]:
+    return {'id': str(user_id), 'username': f'user{user_id % 100000}', 'discriminator': '0', 'global_name': None, 'avatar': None, 'bot': bot}
+
+def message_payload(guild_id: int, channel_id: int, author_id: int, content: str) -> Dict[str, Any]:
+    return {
+        'id': snowflake(),
+        'channel_id': str(channel_id),
+        'guild_id': str(guild_id),
+        'author': user_payload(author_id),
+        'member': {'roles': [], 'joined_at': timestamp(), 'deaf': False, 'mute': False, 'flags': 0},
+        'content': content,
+        'timestamp': timestamp(),
+        'edited_timestamp': None,
+        'tts': False,
+        'mention_everyone': False,
+        'mentions': [],
+        'mention_roles': [],
+        'attachments': [],
+        'embeds': [],
+        'pinned': False,
+        'type': 0,
+    }
+
+def guild_payload(guild_id: int, members: int) -> Dict[str, Any]:
+    return {
+        'id': str(guild_id),
+        'name': f'guild {guild_id - GUILD_BASE}',
+        'owner_id': str(USER_BASE),
+        'member_count': members,
+        'large': members > 250,
+        'roles': [{'id': str(guild_id), 'name': '@everyone', 'permissions': str(discord.Permissions.text().value), 'position': 0, 'color': 0, 'hoist': False, 'managed': False, 'mentionable': False}],
+        'channels': [{'id': str(guild_id + 1), 'type': 0, 'name': 'general', 'position': 0, 'permission_overwrites': [], 'guild_id': str(guild_id)}],
+        'members': [],
+        'emojis': [],
+        'stickers': [],
+        'features': [],
+        'threads': [],
+        'voice_states': [],
+        'presences': [],
+    }
+
+class FakeRESTTransport:
+
+    # stands in for HTTPClient.request
+    # discord allows 5 messages per 5 seconds per channel, and HTTPClient sleeps and retries on a 429
+    # so a rate limited send here waits out the window the same way and counts the 429
+    def __init__(self, latency: float, jitter: float, bucket_size: int = 5, bucket_window: float = 5.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.bucket_size = bucket_size
+        self.bucket_window = bucket_window
+        self.buckets: Dict[str, List[float]] = {}
+        self.requests = 0
+        self.rate_limited = 0
+        self.reply_times: Dict[str, float] = {}
+        self.sent: Dict[str, float] = {}
+
+    def install(self, client: discord.Client):
+        client.http.request = self.request
+
+    async def _rate_limit(self, bucket: str):
+        while True:
+            now = time.monotonic()
+            window = [sent for sent in self.buckets.get(bucket, []) if now - sent < self.bucket_window]
+            if len(window) < self.bucket_size:
+                window.append(now)
+                self.buckets[bucket] = window
+                return
+            self.buckets[bucket] = window
+            self.rate_limited += 1
+            await asyncio.sleep(self.bucket_window - (now - window[0]))
+
+    async def request(self, route: discord.http.Route, *, files=None, form=None, **kwargs) -> Any:
+        self.requests += 1
+        if route.method == 'POST' and route.path == '/channels/{channel_id}/messages':
+            channel_id = str(route.channel_id)
+            await self._rate_limit(channel_id)
+            await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+            payload = kwargs.get('json') or {}
+            reference = payload.get('message_reference') or {}
+            if reference.get('message_id'):
+                self.reply_times[str(reference['message_id'])] = time.perf_counter()
+            reply = {
+                'id': snowflake(), 'channel_id': channel_id, 'author': user_payload(BOT_ID, bot=True),
+                'content': payload.get('content') or '', 'timestamp': timestamp(), 'edited_timestamp': None,
+                'tts': False, 'mention_everyone': False, 'mentions': [], 'mention_roles': [],
+                'attachments': [], 'embeds': [], 'pinned': False, 'type': 0,
+            }
+            return reply
+        await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+        return {}
+
+class FakeGateway:
+
+    def __init__(self, client: DeepBlueSky, transport: FakeRESTTransport, guilds: int, members: int, prefix: str, command_ratio: float, custom_commands: List[str]):
+        self.client = client
+        self.transport = transport
+        self.guild_ids = [GUILD_BASE + 1000 * index for index in range(guilds)]
+        self.members = members
+        self.prefix = prefix
+        self.command_ratio = command_ratio
+        self.custom_commands = custom_commands
+        self.emitted = 0
+        self.emitted_commands = 0
+
+    def connect(self):
+        state = self.client._connection # pylint: disable=protected-access
+        state.user = discord.ClientUser(state=state, data=user_payload(BOT_ID, bot=True))
+        for guild_id in self.guild_ids:
+            state.parsers['GUILD_CREATE'](guild_payload(guild_id, self.members))
+
+    def next_content(self, rng: random.Random) -> Optional[str]:
+        if rng.random() >= self.command_ratio:
+            return 'just chatting about nothing in particular ' * rng.randint(1, 4)
+        kind = rng.random()
+        if kind < 0.4 and self.custom_commands:
+            return f'{self.prefix}{rng.choice(self.custom_commands)}'
+        if kind < 0.6:
+            return f'{self.prefix}ping'
+        if kind < 0.8:
+            return f'{self.prefix}owo hello there, really lovely weather'
+        return f'{self.prefix}search c'
+
+    async def emit(self, rate: float, duration: float, seed: int = 1):
+        rng = random.Random(seed)
+        parse_message_create = self.client._connection.parsers['MESSAGE_CREATE'] # pylint: disable=protected-access
+        interval = 1.0 / rate
+        start = time.perf_counter()
+        next_send = start
+        while time.perf_counter() - start < duration:
+            guild_id = rng.choice(self.guild_ids)
+            author_id = USER_BASE + rng.randrange(1, self.members)
+            content = self.next_content(rng)
+            data = message_payload(guild_id, guild_id + 1, author_id, content)
+            if content.startswith(self.prefix):
+                self.transport.sent[data['id']] = time.perf_counter()
+                self.emitted_commands += 1
+            parse_message_create(data)
+            self.emitted += 1
+            next_send += interval
+            delay = next_send - time.perf_counter()
+            # yield to the loop even when behind schedule
+            await asyncio.sleep(max(0.0, delay))
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def write_custom_commands(storage: str, bot_name: str, guild_ids: List[int], per_guild: int) -> List[str]:
+    names = [f'cmd{index}' for index in range(per_guild)]
+    for guild_id in guild_ids:
+        dirname = f'{storage}/{bot_name}/storage/guild_{guild_id}/commands'
+        os.makedirs(dirname, exist_ok=True)
+        for name in names:
+            with open(f'{dirname}/{name}.json', 'w', encoding='UTF-8') as json_file:
+                json.dump({'type': 'simple', 'name': name, 'author': USER_BASE, 'crtime': 0, 'mtime': 0, 'value': f'value of {name}'}, json_file)
+    return names
+
+# the bot changes into its storage directory and writes its log there,
+# so it is changed back out of, and the log pipeline stopped, before the directory is removed
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='dbs-load-') as storage:
+        try:
+            return await run_in(storage, args)
+        finally:
+            os.chdir(cwd)
+
+async def run_in(storage: str, args: argparse.Namespace) -> Dict[str, Any]:
+    guild_ids = [GUILD_BASE + 1000 * index for index in range(args.guilds)]
+    custom_commands = write_custom_commands(storage, 'load', guild_ids, args.custom_commands)
+    client = DeepBlueSky(bot_name='load', bot_storage_area=storage, chunk_guilds_at_startup=False, loop_lag_threshold=args.lag_threshold)
+    @client.event
+    async def on_message(message: discord.Message) -> None:
+        await client.handle_message(message)
+    transport = FakeRESTTransport(latency=args.latency, jitter=args.jitter)
+    transport.install(client)
+    async with client:
+        if client.loop_monitor:
+            client.loop_monitor.start()
+        gateway = FakeGateway(client, transport, guilds=args.guilds, members=args.members, prefix='--', command_ratio=args.command_ratio, custom_commands=custom_commands)
+        gateway.connect()
+        start = time.perf_counter()
+        await gateway.emit(rate=args.rate, duration=args.duration)
+        emit_time = time.perf_counter() - start
+        # let in-flight replies finish
+        deadline = time.perf_counter() + args.drain
+        while len(transport.reply_times) < len(transport.sent) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        total_time = time.perf_counter() - start
+        latencies = sorted(transport.reply_times[message_id] - sent for message_id, sent in transport.sent.items() if message_id in transport.reply_times)
+        lag = client.loop_monitor.percentiles() if client.loop_monitor else {}
+        if client.loop_monitor:
+            await client.loop_monitor.stop()
+    client.log_pipeline.stop()
+    return {
+        'guilds': args.guilds,
+        'target_rate': args.rate,
+        'messages': gateway.emitted,
+        'commands': gateway.emitted_commands,
+        'achieved_rate': gateway.emitted / emit_time,
+        'replies': len(latencies),
+        'unanswered': gateway.emitted_commands - len(latencies),
+        'reply_throughput': len(latencies) / total_time,
+        'rest_requests': transport.requests,
+        'rate_limited': transport.rate_limited,
+        'reply_latency': {name: percentile(latencies, fraction) for name, fraction in [('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0)]},
+        'loop_lag': lag,
+    }
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='End-to-end load test for Deep Blue Sky against a fake gateway and REST API')
+    parser.add_argument('--guilds', type=int, default=100, help='number of guilds (default: 100)')
+    parser.add_argument('--members', type=int, default=1000, help='members per guild (default: 1000)')
+    parser.add_argument('--custom-commands', type=int, default=20, help='custom commands per guild (default: 20)')
+    parser.add_argument('--rate', type=float, default=200.0, help='messages per second across all guilds (default: 200)')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to send messages for (default: 10)')
+    parser.add_argument('--command-ratio', type=float, default=0.2, help='fraction of messages that are commands (default: 0.2)')
+    parser.add_argument('--latency', type=float, default=0.05, help='mean REST latency in seconds (default: 0.05)')
+    parser.add_argument('--jitter', type=float, default=0.01, help='standard deviation of the REST latency (default: 0.01)')
+    parser.add_argument('--drain', type=float, default=30.0, help='seconds to wait for outstanding replies (default: 30)')
+    parser.add_argument('--lag-threshold', type=float, default=0.25, help='event loop lag warning threshold (default: 0.25)')
+    parser.add_argument('--output', help='write the report to this JSON file')
+    args = parser.parse_args(argv)
+    cwd = os.getcwd()
+    report = asyncio.run(run(args))
+    os.chdir(cwd)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='UTF-8') as json_file:
+            json.dump(report, json_file, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
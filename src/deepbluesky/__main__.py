@@ -2,19 +2,59 @@
 
 # pylint: disable=invalid-name
 
+import argparse
 import asyncio
+
+from typing import List, Optional
+
 import discord
+from .backends import JSON_BACKENDS, LOOP_BACKENDS, select_event_loop, select_json_backend
 from .deepbluesky import DeepBlueSky
+from .intents import INTENT_PROFILES
 
 # Launch a default Deep Blue Sky bot
 
-async def _main():
-    client: DeepBlueSky = DeepBlueSky(bot_name='deep-blue-sky')
+def _shard_list(value: str) -> List[int]:
+    try:
+        return [int(shard_id) for shard_id in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid shard list: {value}') from None
+
+def _parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='deepbluesky', description='Run a Deep Blue Sky bot')
+    parser.add_argument('--bot-name', default='deep-blue-sky', help='name of the bot, used for its storage directory')
+    parser.add_argument('--shard-count', type=int, help='total number of shards across all processes')
+    parser.add_argument('--shard-ids', type=_shard_list, help='comma-separated shard IDs to run in this process')
+    parser.add_argument('--log-stderr', action='store_true', help='also write the log to stderr')
+    parser.add_argument('--log-json', action='store_true', help='write the log as one JSON object per line')
+    parser.add_argument('--metrics-port', type=int, help='serve metrics on this local port')
+    parser.add_argument('--dispatch', choices=['messages', 'interactions', 'both'], default='messages', help='read commands from messages with the prefix, from slash commands, or both; interactions alone drops the message content intent (default: messages)')
+    parser.add_argument('--intents', dest='intent_profile', choices=INTENT_PROFILES, default='full', help='gateway events to subscribe to: minimal (slash commands only), wikitext (messages, no member list) or full (default: full)')
+    parser.add_argument('--loop-backend', choices=LOOP_BACKENDS, help='event loop implementation, auto uses uvloop if it is installed (default: $DEEPBLUESKY_LOOP or auto)')
+    parser.add_argument('--json-backend', choices=JSON_BACKENDS, help='JSON implementation for storage, auto uses orjson or ujson if installed (default: $DEEPBLUESKY_JSON or auto)')
+    parser.add_argument('--progressive-wikitext', dest='wiki_progressive', action='store_true', help='reply to wikitext as soon as the first article is found and edit the reply as the rest arrive')
+    parser.add_argument('--watch-storage', action='store_true', help='reload spaces whose files under storage/ are changed by other programs')
+    parser.add_argument('--no-chunk-at-startup', dest='chunk_guilds_at_startup', action='store_false', help='do not download the member list of every guild at startup, look members up when a command needs them')
+    parser.add_argument('--chunk-active-guilds', action='store_true', help='with --no-chunk-at-startup, download the member list of a guild once someone uses the bot there')
+    parser.add_argument('--no-resume', dest='resume_sessions', action='store_false', help='always IDENTIFY instead of resuming the gateway session saved at the last shutdown')
+    args = parser.parse_args(argv)
+    if args.shard_ids is not None and args.shard_count is None:
+        parser.error('--shard-ids requires --shard-count')
+    return args
+
+async def _main(args: argparse.Namespace):
+    client: DeepBlueSky = DeepBlueSky(bot_name=args.bot_name, shard_count=args.shard_count, shard_ids=args.shard_ids, metrics_port=args.metrics_port, log_stderr=args.log_stderr, log_json=args.log_json, resume_sessions=args.resume_sessions, dispatch=args.dispatch, intent_profile=args.intent_profile, wiki_progressive=args.wiki_progressive, watch_storage=args.watch_storage, chunk_guilds_at_startup=args.chunk_guilds_at_startup, chunk_active_guilds=args.chunk_active_guilds)
     @client.event
     async def on_message(message: discord.Message) -> None:
         await client.handle_message(message)
+    @client.event
+    async def on_message_edit(before: discord.Message, after: discord.Message) -> None:
+        await client.handle_message_edit(before, after)
     async with client:
         await client.run_bot()
 
 if __name__ == '__main__':
-    asyncio.run(_main())
+    _args = _parse_args()
+    select_event_loop(_args.loop_backend)
+    select_json_backend(_args.json_backend)
+    asyncio.run(_main(_args))
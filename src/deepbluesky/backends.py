@@ -0,0 +1,129 @@
+# backends.py
+# optional faster implementations of the event loop and of json
+# chosen at startup, with the standard library as the fallback
+from __future__ import annotations
+
+import asyncio
+import importlib
+import json
+import logging
+import os
+
+from typing import IO, Any, Callable, Optional
+
+from .startup import timeline
+
+LOOP_BACKENDS = ('auto', 'asyncio', 'uvloop')
+JSON_BACKENDS = ('auto', 'json', 'orjson', 'ujson')
+
+def _import(module_name: str) -> Optional[Any]:
+    try:
+        with timeline.measure(f'import {module_name}'):
+            return importlib.import_module(module_name)
+    except ImportError:
+        return None
+
+# returns the name of the backend in use
+def select_event_loop(name: Optional[str] = None) -> str:
+    if name is None:
+        name = os.environ.get('DEEPBLUESKY_LOOP', 'auto')
+    if name not in LOOP_BACKENDS:
+        raise ValueError(f'Invalid event loop backend: {name}')
+    if name in ('auto', 'uvloop'):
+        uvloop = _import('uvloop')
+        if uvloop is not None:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            return 'uvloop'
+        if name == 'uvloop':
+            logging.getLogger('discord').warning('uvloop is not installed, using asyncio')
+    return 'asyncio'
+
+def event_loop_name() -> str:
+    return type(asyncio.get_event_loop_policy()).__module__.split('.')[0]
+
+# a bit of everything that ends up in storage
+_PROBE = {
+    'type': 'simple', 'name': 'c-1.?', 'author': 123456789012345678, 'crtime': 1600000000, 'mtime': None,
+    'value': 'line\nline "quoted" \\ / <a href="x">&amp;</a>\t\x00\x1f\x7f é ß 漢字 😀', 'wikitext': False,
+    'time': 1712345678.123456, 'usage': {'guild_1': {'x': [3, 1700000000]}}, 'empty': [], 'nested': [{}, [0.1, -2, 1e-07]],
+}
+
+class JSONBackend:
+
+    # the decoder is used whenever the module has one
+    # the encoder only if it writes exactly what json.dump would, so files stay byte for byte the same
+    def __init__(self, name: str, loads: Callable[[str], Any] = json.loads, dumps: Optional[Callable[[Any], str]] = None):
+        self.name = name
+        self.loads = loads
+        self.fast_dumps = dumps is not None
+        self.dumps = dumps if dumps is not None else json.dumps
+
+    def load(self, json_file: IO[str]) -> Any:
+        return self.loads(json_file.read())
+
+    def dump(self, obj: Any, json_file: IO[str]):
+        json_file.write(self.dumps(obj))
+
+    def describe(self) -> str:
+        if self.name == 'json' or self.fast_dumps:
+            return self.name
+        return f'{self.name} (decoding only, json for encoding)'
+
+def _orjson_backend(orjson: Any) -> JSONBackend:
+    def loads(text: str) -> Any:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            # json is more lenient, with lone surrogates, NaN and integers over 64 bits
+            # and raises the same error if the file really is broken
+            return json.loads(text)
+    # orjson only writes compact utf-8, which is never what json.dump writes
+    return JSONBackend('orjson', loads=loads)
+
+def _ujson_backend(ujson: Any) -> JSONBackend:
+    def loads(text: str) -> Any:
+        try:
+            return ujson.loads(text)
+        except ValueError as ex:
+            raise json.JSONDecodeError(str(ex), text, 0) from ex
+    def dumps(obj: Any) -> str:
+        return ujson.dumps(obj, ensure_ascii=True, escape_forward_slashes=False, separators=(', ', ': '))
+    try:
+        identical = dumps(_PROBE) == json.dumps(_PROBE)
+    except TypeError:
+        # older versions do not take separators
+        identical = False
+    return JSONBackend('ujson', loads=loads, dumps=dumps if identical else None)
+
+_JSON_BACKEND: Optional[JSONBackend] = None
+
+def select_json_backend(name: Optional[str] = None) -> JSONBackend:
+    # pylint: disable=global-statement
+    global _JSON_BACKEND
+    if name is None:
+        name = os.environ.get('DEEPBLUESKY_JSON', 'auto')
+    if name not in JSON_BACKENDS:
+        raise ValueError(f'Invalid JSON backend: {name}')
+    backend = None
+    for candidate, make_backend in (('orjson', _orjson_backend), ('ujson', _ujson_backend)):
+        if name not in ('auto', candidate):
+            continue
+        module = _import(candidate)
+        if module is not None:
+            backend = make_backend(module)
+            break
+        if name == candidate:
+            logging.getLogger('discord').warning(f'{candidate} is not installed, using json')
+    _JSON_BACKEND = backend if backend is not None else JSONBackend('json')
+    return _JSON_BACKEND
+
+def json_backend() -> JSONBackend:
+    if _JSON_BACKEND is None:
+        return select_json_backend()
+    return _JSON_BACKEND
+
+def load_json(json_file: IO[str]) -> Any:
+    return json_backend().load(json_file)
+
+def dump_json(obj: Any, json_file: IO[str]):
+    json_backend().dump(obj, json_file)
@@ -0,0 +1,64 @@
+# cache.py
+# bounded caches shared by the rest of the bot
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Any, Hashable, Iterator, Optional
+
+_MISSING = object()
+
+class LRUCache:
+
+    def __init__(self, maxsize: int):
+        if maxsize <= 0:
+            raise ValueError(f'Invalid cache size: {maxsize}')
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, Any] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._data.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        return self._data.pop(key, default)
+
+    def clear(self):
+        self._data.clear()
+
+    def resize(self, maxsize: int):
+        if maxsize <= 0:
+            raise ValueError(f'Invalid cache size: {maxsize}')
+        self.maxsize = maxsize
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def stats(self) -> str:
+        return f'{len(self._data)}/{self.maxsize} entries, {self.hits} hits, {self.misses} misses'
+
+    def __setitem__(self, key: Hashable, value: Any):
+        self.put(key, value)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(list(self._data))
+
+    def peek(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        return self._data.get(key, default)
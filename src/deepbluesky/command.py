@@ -1,28 +1,60 @@
 # command.py
 from __future__ import annotations
 import abc
+import asyncio
+import sys
+import time
 
 from typing import TYPE_CHECKING, Any, Optional
-from typing import Awaitable, Callable, Dict, List
+from typing import Awaitable, Callable, Dict, List, Sequence, Tuple
 
 import discord
 
+from .cache import LRUCache
+from .metrics import command_calls, command_latency
+from .text import MESSAGE_LIMIT, TemplatePart, compile_template
+
 if TYPE_CHECKING:
     from .space import Space
 
+def _timestamp(value: Optional[Any]) -> Optional[int]:
+    return int(value) if value is not None else None
+
 class Command(abc.ABC):
 
     # pylint: disable=function-redefined
 
+    # there can be a very large number of these
+    # so keep them compact
+    __slots__ = ('name', 'author', '_aliases', 'command_type', 'creation_time', 'modification_time', 'space')
+
     def __init__(self, name: str, author: Optional[int], command_type: str, creation_time: Optional[int], modification_time: Optional[int], space: Optional[Space] = None):
-        self.name = name
+        self.name = sys.intern(name)
         self.author = author
-        self.aliases: List[CommandAlias] = []
-        self.command_type = command_type
-        self.creation_time = creation_time
-        self.modification_time = modification_time
+        # most commands never get aliased
+        # so only allocate the list on demand
+        self._aliases: Optional[List[CommandAlias]] = None
+        self.command_type = sys.intern(command_type)
+        self.creation_time = _timestamp(creation_time)
+        self.modification_time = _timestamp(modification_time)
         self.space = space
 
+    @property
+    def aliases(self) -> Sequence[CommandAlias]:
+        return self._aliases if self._aliases is not None else ()
+
+    def add_alias(self, alias: CommandAlias):
+        if self._aliases is None:
+            self._aliases = []
+        self._aliases.append(alias)
+
+    def remove_alias(self, alias: CommandAlias):
+        if self._aliases is None:
+            raise ValueError(f'{alias.name} is not an alias of {self.name}')
+        self._aliases.remove(alias)
+        if not self._aliases:
+            self._aliases = None
+
     # the returned value is the success bool
     # the command message has already been sent to the channel
     @abc.abstractmethod
@@ -34,20 +66,32 @@ class Command(abc.ABC):
             # This should not happen
             space.client.logger.error(f'Command {self.name} owned by another space: {self.space}, not {space}')
             return False
+        log_fields = {'space_id': space.space_id, 'command': self.name, 'author': trigger.author.id}
         if await self.can_call(trigger, space):
+            # an alias calls its target, which counts the call
+            if self.command_type != 'alias':
+                space.client.usage.record(space.space_id, self.name)
+            start = time.perf_counter()
             try:
                 result = await self._invoke0(trigger, space, name_used, command_predicate)
+                log_fields['latency'] = time.perf_counter() - start
                 if result:
-                    space.client.logger.info(f'Command succeeded, author: {trigger.author.id}, name: {self.name}')
+                    space.client.logger.info(f'Command succeeded, author: {trigger.author.id}, name: {self.name}', extra=log_fields)
                 else:
-                    space.client.logger.info(f'Command failed, author: {trigger.author.id}, name: {self.name}')
+                    space.client.logger.info(f'Command failed, author: {trigger.author.id}, name: {self.name}', extra=log_fields)
+                command_calls.inc(self.name, 'success' if result else 'failure')
                 return result
             # pylint: disable=broad-except
             except Exception as ex:
-                space.client.logger.critical(f'Unexpected exception during command invocation: {str(ex)}', exc_info=True)
+                log_fields['latency'] = time.perf_counter() - start
+                space.client.logger.critical(f'Unexpected exception during command invocation: {str(ex)}', exc_info=True, extra=log_fields)
+                command_calls.inc(self.name, 'error')
                 return False
+            finally:
+                command_latency.observe(time.perf_counter() - start, self.name)
         else:
-            space.client.logger.warning(f'User {trigger.author.id} illegally attempted command {self.name}')
+            space.client.logger.warning(f'User {trigger.author.id} illegally attempted command {self.name}', extra=log_fields)
+            command_calls.inc(self.name, 'denied')
             return False
 
     @abc.abstractmethod
@@ -93,16 +137,75 @@ class Command(abc.ABC):
 
 class CommandSimple(Command):
 
-    def __init__(self, name: str, value: str, author: Optional[int] = None,  creation_time: Optional[int] = None, modification_time: Optional[int] = None, space: Optional[Space] = None, builtin: bool = False, helpstring: Optional[str] = None):
-        super().__init__(name=name, author=author, command_type='simple', creation_time=creation_time, modification_time=modification_time, space=space)
-        self.value = value
+    __slots__ = ('_value', 'generation', 'builtin', 'helpstring')
+
+    # values of commands loaded from storage are read on demand
+    # and only the most recently used ones are kept in memory
+    value_cache: LRUCache = LRUCache(maxsize=4096)
+
+    # value=None means the value lives in storage, which requires a space
+    def __init__(self, name: str, value: Optional[str], author: Optional[int] = None,  creation_time: Optional[int] = None, modification_time: Optional[int] = None, space: Optional[Space] = None, builtin: bool = False, helpstring: Optional[str] = None, command_type: str = 'simple'):
+        super().__init__(name=name, author=author, command_type=command_type, creation_time=creation_time, modification_time=modification_time, space=space)
+        if value is None and space is None:
+            raise ValueError(f'Command without a value must belong to a space: {name}')
+        self._value = value
+        # changes whenever the value does, so a value read from storage
+        # in the meantime is known to be out of date
+        self.generation = 0
         self.builtin = builtin
         self.helpstring = helpstring if helpstring else 'a simple command replies with its value'
 
+    @property
+    def value(self) -> str:
+        if self._value is not None:
+            return self._value
+        value = CommandSimple.value_cache.get(self)
+        if value is None:
+            value = self.space.load_command_value(self.name)
+            CommandSimple.value_cache.put(self, value)
+        return value
+
+    @value.setter
+    def value(self, value: str):
+        CommandSimple.value_cache.pop(self)
+        self._value = value
+        self.generation += 1
+
+    # the same, with the file read off the event loop
+    async def get_value(self) -> str:
+        if self._value is not None:
+            return self._value
+        value = CommandSimple.value_cache.get(self)
+        if value is None:
+            generation = self.generation
+            value = await asyncio.get_running_loop().run_in_executor(None, self.space.load_command_value, self.name)
+            if not self.cache_loaded_value(value, generation):
+                # changed while the file was being read
+                return await self.get_value()
+        return value
+
+    # for a value read from storage while the generation was `generation`
+    def cache_loaded_value(self, value: str, generation: int) -> bool:
+        if self._value is not None or self.generation != generation:
+            return False
+        CommandSimple.value_cache.put(self, value)
+        return True
+
+    def is_resident(self) -> bool:
+        return self._value is not None
+
+    # drop the in-memory copy of the value once it has been saved
+    def unload_value(self):
+        if self._value is None or self.space is None or self.builtin:
+            return
+        CommandSimple.value_cache.put(self, self._value)
+        self._value = None
+        self.generation += 1
+
     # override
     async def _invoke0(self, trigger: discord.Message, space: Space, name_used: str, command_predicate: Optional[str]) -> bool:
         try:
-            await space.client.send_to_channel(trigger.channel, trigger.reference if trigger.reference else trigger, self.value)
+            await space.client.send_to_channel(trigger.channel, trigger.reference if trigger.reference else trigger, await self.get_value())
         except discord.Forbidden:
             space.client.logger.error(f'Insufficient permissions to send to channel. id: {trigger.channel.id}, name: {self.name}')
             return False
@@ -117,14 +220,86 @@ class CommandSimple(Command):
     def _get_dict0(self) -> Dict[str, Any]:
         return {'value': self.value}
 
+class CommandTemplate(CommandSimple):
+
+    # pylint: disable=function-redefined
+
+    __slots__ = ()
+
+    # parsed templates, so calling one is just a join
+    compiled_cache: LRUCache = LRUCache(maxsize=1024)
+
+    def __init__(self, name: str, value: Optional[str], author: Optional[int] = None, creation_time: Optional[int] = None, modification_time: Optional[int] = None, space: Optional[Space] = None):
+        super().__init__(name=name, value=value, author=author, creation_time=creation_time, modification_time=modification_time, space=space, helpstring='a template command fills its value in with the arguments', command_type='template')
+
+    @CommandSimple.value.setter
+    def value(self, value: str):
+        CommandTemplate.compiled_cache.pop(self)
+        CommandSimple.value.fset(self, value)
+
+    def compiled(self) -> Tuple[TemplatePart, ...]:
+        parts = CommandTemplate.compiled_cache.get(self)
+        if parts is None:
+            parts = compile_template(self.value)
+            CommandTemplate.compiled_cache.put(self, parts)
+        return parts
+
+    # raises ValueError if the output would be too long to send
+    def render(self, trigger: discord.Message, command_predicate: Optional[str]) -> str:
+        args = command_predicate.strip() if command_predicate else ''
+        words: Optional[List[str]] = None
+        output: List[str] = []
+        length = 0
+        for part in self.compiled():
+            if not isinstance(part, str):
+                kind, index = part
+                if kind == 'args':
+                    part = args
+                elif kind == 'arg':
+                    if words is None:
+                        words = args.split()
+                    part = words[index - 1] if index <= len(words) else ''
+                elif kind == 'author':
+                    part = trigger.author.mention
+                else:
+                    part = f'<t:{int(time.time())}:f>'
+            length += len(part)
+            if length > MESSAGE_LIMIT:
+                raise ValueError(f'Output of `{self.name}` is longer than {MESSAGE_LIMIT} characters')
+            output.append(part)
+        return ''.join(output)
+
+    # override
+    async def _invoke0(self, trigger: discord.Message, space: Space, name_used: str, command_predicate: Optional[str]) -> bool:
+        reply_to = trigger.reference if trigger.reference else trigger
+        # so compiling it does not read the file on the event loop
+        if CommandTemplate.compiled_cache.peek(self) is None:
+            await self.get_value()
+        try:
+            content = self.render(trigger, command_predicate)
+        except ValueError as ex:
+            await space.client.send_to_channel(trigger.channel, reply_to, str(ex))
+            return False
+        if not content.strip():
+            await space.client.send_to_channel(trigger.channel, reply_to, f'Output of `{self.name}` is empty')
+            return False
+        try:
+            await space.client.send_to_channel(trigger.channel, reply_to, content)
+        except discord.Forbidden:
+            space.client.logger.error(f'Insufficient permissions to send to channel. id: {trigger.channel.id}, name: {self.name}')
+            return False
+        return True
+
 class CommandAlias(Command):
 
     # pylint: disable=function-redefined
 
+    __slots__ = ('value', 'builtin')
+
     def __init__(self, name: str, value: Command, author: Optional[int] = None, creation_time: Optional[int] = None, modification_time: Optional[int] = None, space: Optional[Space] = None, builtin: Optional[bool] = None):
         super().__init__(name=name, author=author, command_type='alias', creation_time=creation_time, modification_time=creation_time, space=space)
         self.value = value
-        self.value.aliases.append(self)
+        self.value.add_alias(self)
         self.builtin = builtin if builtin is not None else self.value.is_builtin()
 
     async def _invoke0(self, trigger: discord.Message, space: Space, name_used: str, command_predicate: Optional[str]) -> bool:
@@ -163,14 +338,22 @@ class CommandAlias(Command):
 
 class CommandFunction(Command):
 
-    def __init__(self, name: str, value: Callable[[discord.Message, Space, str, Optional[str]], Awaitable[bool]], helpstring: str):
+    __slots__ = ('value', 'helpstring', 'owner_only')
+
+    def __init__(self, name: str, value: Callable[[discord.Message, Space, str, Optional[str]], Awaitable[bool]], helpstring: str, owner_only: bool = False):
         super().__init__(name=name, author=None, command_type='function', creation_time=None, modification_time=None)
         self.value = value
         self.helpstring = helpstring
+        self.owner_only = owner_only
 
     def is_builtin(self) -> bool:
         return True
 
+    async def can_call(self, trigger: discord.Message, space: Space) -> bool:
+        if self.owner_only:
+            return await space.client.is_bot_owner(trigger.author)
+        return True
+
     async def _invoke0(self, trigger: discord.Message, space: Space, name_used: str, command_predicate: Optional[str]) -> bool:
         return await self.value(trigger, space, name_used, command_predicate)
 
@@ -6,6 +6,7 @@
 
 import abc
 import asyncio
+import concurrent.futures
 import datetime
 import functools
 import io
@@ -16,22 +17,39 @@ import re
 import signal
 import sys
 import time
-import warnings
 
 from collections import OrderedDict
 from typing import Any, Callable, Literal, Optional, Union
-from typing import Dict, FrozenSet, Iterable, List, Tuple
-
-import dateutil.parser
-import discord
-import requests
-
-from .command import Command
-from .command import CommandAlias, CommandFunction, CommandSimple
-from .space import Space
-from .space import ChannelSpace, DMSpace, GuildSpace
-from .text import identity, owoify, removeprefix, spongebob, pluralize
-from .wiki import lookup_wikis
+from typing import Dict, FrozenSet, Iterable, List, Set, Tuple, Type
+
+from .startup import timeline
+
+# pylint: disable=wrong-import-position
+with timeline.measure('import discord'):
+    import discord
+    import yarl
+
+with timeline.measure('import deepbluesky modules'):
+    from .backends import event_loop_name, json_backend, load_json
+    from .cache import LRUCache
+    from .command import Command
+    from .command import CommandAlias, CommandFunction, CommandSimple, CommandTemplate
+    from .fuzzy import NameIndex
+    from .intents import profile_intents
+    from .interactions import InteractionDispatcher
+    from .logs import LogPipeline, setup_logging
+    from .loopmonitor import LoopMonitor
+    from .memory import TracemallocSession, memory_report
+    from .metrics import MetricsServer, filtered_messages, gateway_events, registry, send_latency, space_messages
+    from .profiler import cprofile_event_loop, profile_filename, sample_event_loop
+    from .session import SessionStore
+    from .timeparse import UnknownTimezoneError, parse_time
+    from .usage import UsageStore
+    from .watcher import StorageWatcher
+    from .space import CommandBatch, Space
+    from .space import ChannelSpace, DMSpace, GuildSpace
+    from .text import TRANSFORMS, compile_pipeline, compile_template, identity, removeprefix, pluralize, split_message
+    from .wiki import lookup_wikis
 
 def split_command(command_string: Optional[str]) -> Tuple[str, Optional[str]]:
     if not command_string:
@@ -67,9 +85,24 @@ def get_all_noncode_chunks(message_string: str) -> List[str]:
     # cast to list to return a proper list
     return [y for x in chunks for y in x]
 
-class DeepBlueSky(discord.Client):
+def find_articles(message_string: str) -> List[str]:
+    article_chunks = [re.findall(r'\[\[(.*?)\]\]', chunk) for chunk in get_all_noncode_chunks(message_string)]
+    return [article for chunk in article_chunks for article in chunk if len(article.strip()) > 0]
+
+class WikiReply:
 
-    async def send_to_channel(self, channel: discord.abc.Messageable, reply_to: Optional[Union[discord.Message, discord.MessageReference]], content: Optional[str], ping_user: Optional[List[int]] = None, ping_roles: Optional[List[int]] = None, attachments: Optional[List[discord.File]] = None):
+    # the lookups for one message, kept around so that an edit
+    # only looks up the articles it added
+    def __init__(self):
+        self.articles: List[str] = []
+        self.lookups: Dict[str, asyncio.Future] = {}
+        self.reply: Optional[discord.Message] = None
+        self.generation = 0
+        self.lock = asyncio.Lock()
+
+class DeepBlueSky(discord.AutoShardedClient):
+
+    async def send_to_channel(self, channel: discord.abc.Messageable, reply_to: Optional[Union[discord.Message, discord.MessageReference]], content: Optional[str], ping_user: Optional[List[int]] = None, ping_roles: Optional[List[int]] = None, attachments: Optional[List[discord.File]] = None) -> Optional[discord.Message]:
         if ping_user is None:
             ping_user = []
         if ping_roles is None:
@@ -79,7 +112,11 @@ class DeepBlueSky(discord.Client):
             ping_roles = [channel.guild.get_role(role) for role in ping_roles]
         else:
             ping_roles = []
-        await channel.send(content=content, allowed_mentions=discord.AllowedMentions(users=ping_user, roles=ping_roles), files=attachments, reference=reply_to, mention_author=False)
+        start = time.perf_counter()
+        try:
+            return await channel.send(content=content, allowed_mentions=discord.AllowedMentions(users=ping_user, roles=ping_roles), files=attachments, reference=reply_to, mention_author=False)
+        finally:
+            send_latency.observe(time.perf_counter() - start)
 
     # command functions
 
@@ -133,7 +170,7 @@ class DeepBlueSky(discord.Client):
         await self.send_to_channel(trigger.channel, trigger, msg)
         return success
 
-    async def create_command(self, trigger: discord.Message, space: Space, command_name: str, command_predicate: Optional[str]) -> bool:
+    async def create_command(self, trigger: discord.Message, space: Space, command_name: str, command_predicate: Optional[str], command_class: Type[CommandSimple] = CommandSimple) -> bool:
         usage = f'Usage: `{command_name}` <command_name> <command_value | attachment>'
         new_name, new_value = split_command(command_predicate)
         if not new_name:
@@ -142,21 +179,34 @@ class DeepBlueSky(discord.Client):
         if not re.match(r'^[a-z_\-\.][a-z0-9_\-\.!?]*$', new_name):
             await self.send_to_channel(trigger.channel, trigger, f'Invalid command name: `{new_name}`\nOnly ASCII alphanumeric characters or `-_!.?` permitted.\nCommands also cannot start with a number or `!?`.\n{usage}')
             return False
-        if self.find_command(space, new_name, follow_alias=False):
-            await self.send_to_channel(trigger.channel, trigger, f'The command `{new_name}` already exists in this space. Use `updatecommand` instead.')
-            return False
-        lines = [x.strip() for x in [new_value] if x] + [attachment.url for attachment in trigger.attachments]
-        if len(lines) == 0:
-            await self.send_to_channel(trigger.channel, trigger, f'Command value may not be empty\n{usage}')
-            return False
-        new_value = '\n'.join(lines)
-        command = CommandSimple(name=new_name, value=new_value, author=trigger.author.id, creation_time=int(time.time()), modification_time=int(time.time()))
-        space.custom_command_dict[new_name] = command
-        success = space.save_command(new_name)
+        # checked and applied under the lock, so a bulk change being saved cannot overwrite it
+        async with space.lock:
+            if self.find_command(space, new_name, follow_alias=False):
+                await self.send_to_channel(trigger.channel, trigger, f'The command `{new_name}` already exists in this space. Use `updatecommand` instead.')
+                return False
+            lines = [x.strip() for x in [new_value] if x] + [attachment.url for attachment in trigger.attachments]
+            if len(lines) == 0:
+                await self.send_to_channel(trigger.channel, trigger, f'Command value may not be empty\n{usage}')
+                return False
+            new_value = '\n'.join(lines)
+            if not await self.check_command_value(trigger, command_class, new_value):
+                return False
+            command = command_class(name=new_name, value=new_value, author=trigger.author.id, creation_time=int(time.time()), modification_time=int(time.time()), space=space)
+            space.add_command(command)
+            success = space.save_command(new_name)
         msg = f'Command added successfully. Try it with: `{self.get_property(space, "command_prefix")}{new_name}`' if success else 'Unknown error when evaluating command'
         await self.send_to_channel(trigger.channel, trigger, msg)
         return success
 
+    async def check_command_value(self, trigger: discord.Message, command_class: Type[Command], value: str) -> bool:
+        if issubclass(command_class, CommandTemplate):
+            try:
+                compile_template(value)
+            except ValueError as ex:
+                await self.send_to_channel(trigger.channel, trigger, f'{ex}\nPlaceholders: `{{args}}`, `{{1}}`, `{{2}}`, ..., `{{author}}`, `{{time}}`. Use `{{{{` and `}}}}` for literal braces.')
+                return False
+        return True
+
     async def user_exists(self, user_id: int, channel: discord.abc.Messageable) -> bool:
         user = await self.get_or_fetch_user(user_id, channel=channel)
         return user is not None
@@ -175,32 +225,24 @@ class DeepBlueSky(discord.Client):
         while remainder:
             new_name, remainder = split_command(remainder)
             command_set.add(new_name)
-        for name in command_set:
-            if name in self.builtin_command_dict:
-                await self.send_to_channel(trigger.channel, trigger, 'Built-in commands cannot be removed.')
-                return False
-            if name not in space.custom_command_dict:
-                await self.send_to_channel(trigger.channel, trigger, f'Unknown command in this space: `{name}`')
-                return False
-            author_id = space.custom_command_dict[name].author
-            if author_id and author_id != trigger.author.id and not space.is_moderator(trigger.author) and await self.user_exists(author_id, trigger.channel):
-                await self.send_to_channel(trigger.channel, trigger, f'The command `{name}` blongs to <@!{author_id}>. You cannot remove it.')
-                return False
-        success = True
-        success_list = []
-        while len(command_set) > 0:
-            for name in list(command_set):
-                command = space.custom_command_dict[name]
-                command_set.update({alias.name for alias in command.aliases})
-                if isinstance(command, CommandAlias):
-                    command.follow().aliases.remove(command)
-                del space.custom_command_dict[name]
-                if space.save_command(name):
-                    success_list += [name]
-                else:
-                    success=False
-                command_set.remove(name)
-        msg = f'Command removed successfully: `{", ".join(success_list)}`' if success else 'Unknown error when evaluating command'
+        # checked and applied under the lock, so nothing changes in between
+        async with space.lock:
+            for name in command_set:
+                if name in self.builtin_command_dict:
+                    await self.send_to_channel(trigger.channel, trigger, 'Built-in commands cannot be removed.')
+                    return False
+                if name not in space.custom_command_dict:
+                    await self.send_to_channel(trigger.channel, trigger, f'Unknown command in this space: `{name}`')
+                    return False
+                author_id = space.custom_command_dict[name].author
+                if author_id and author_id != trigger.author.id and not space.is_moderator(trigger.author) and await self.user_exists(author_id, trigger.channel):
+                    await self.send_to_channel(trigger.channel, trigger, f'The command `{name}` blongs to <@!{author_id}>. You cannot remove it.')
+                    return False
+            batch = CommandBatch(space)
+            for name in command_set:
+                batch.remove(name)
+            success = await batch.commit()
+        msg = f'Command removed successfully: `{", ".join(batch.names())}`' if success else 'Unknown error when evaluating command'
         await self.send_to_channel(trigger.channel, trigger, msg)
         return success
 
@@ -216,25 +258,29 @@ class DeepBlueSky(discord.Client):
         if new_name in self.builtin_command_dict:
             await self.send_to_channel(trigger.channel, trigger, 'Built-in commands cannot be updated.')
             return False
-        if new_name not in space.custom_command_dict:
-            await self.send_to_channel(trigger.channel, trigger, f'Unknown command in this space: `{new_name}`')
-            return False
-        command = space.custom_command_dict[new_name]
-        if command.author and command.author != trigger.author.id and not space.is_moderator(trigger.author) and await self.user_exists(command.author, trigger.channel):
-            await self.send_to_channel(trigger.channel, trigger, f'The command `{command.name}` blongs to <@!{command.author}>. You cannot update it.')
-            return False
-        lines = [x.strip() for x in [new_value] if x] + [attachment.url for attachment in trigger.attachments]
-        if len(lines) == 0:
-            await self.send_to_channel(trigger.channel, trigger, f'Command value may not be empty\n{usage}')
-            return False
-        new_value = '\n'.join(lines)
-        if isinstance(command, CommandSimple):
-            command.value = new_value
-        else:
-            self.logger.critical(f'custom command not simple: {command}')
-            await self.send_to_channel(trigger.channel, trigger, 'Unknown error when evaluating command')
-            return False
-        success = space.save_command(new_name)
+        # checked and applied under the lock, so a bulk change being saved cannot overwrite it
+        async with space.lock:
+            if new_name not in space.custom_command_dict:
+                await self.send_to_channel(trigger.channel, trigger, f'Unknown command in this space: `{new_name}`')
+                return False
+            command = space.custom_command_dict[new_name]
+            if command.author and command.author != trigger.author.id and not space.is_moderator(trigger.author) and await self.user_exists(command.author, trigger.channel):
+                await self.send_to_channel(trigger.channel, trigger, f'The command `{command.name}` blongs to <@!{command.author}>. You cannot update it.')
+                return False
+            lines = [x.strip() for x in [new_value] if x] + [attachment.url for attachment in trigger.attachments]
+            if len(lines) == 0:
+                await self.send_to_channel(trigger.channel, trigger, f'Command value may not be empty\n{usage}')
+                return False
+            new_value = '\n'.join(lines)
+            if not await self.check_command_value(trigger, type(command), new_value):
+                return False
+            if isinstance(command, CommandSimple):
+                command.value = new_value
+            else:
+                self.logger.critical(f'custom command not simple: {command}')
+                await self.send_to_channel(trigger.channel, trigger, 'Unknown error when evaluating command')
+                return False
+            success = space.save_command(new_name)
         msg = f'Command updated successfully. Try it with: `{self.get_property(space, "command_prefix")}{new_name}`' if success else 'Unknown error when evaluating command'
         await self.send_to_channel(trigger.channel, trigger, msg)
         return success
@@ -267,26 +313,23 @@ class DeepBlueSky(discord.Client):
         while remainder:
             new_name, remainder = split_command(remainder)
             command_set.add(new_name)
-        for name in command_set:
-            if name in self.builtin_command_dict:
-                await self.send_to_channel(trigger.channel, trigger, f'Built-in commands cannot be {participle}.')
-                return False
-            if name not in space.custom_command_dict:
-                await self.send_to_channel(trigger.channel, trigger, f'Unknown command in this space: `{name}`')
-                return False
-            author_id = space.custom_command_dict[name].author
-            if author_id and author_id != trigger.author.id and not space.is_moderator(trigger.author) and await self.user_exists(author_id, trigger.channel):
-                await self.send_to_channel(trigger.channel, trigger, f'The command `{name}` blongs to <@!{author_id}>. You cannot {verb} it.')
-                return False
-        success = True
-        success_list = []
-        for name in command_set:
-            space.custom_command_dict[name].author = give_id
-            if space.save_command(name):
-                success_list += [name]
-            else:
-                success = False
-        msg = f'Command ownership transfered successfully for: `{", ".join(success_list)}`' if success else 'Unknown error when evaluating command'
+        async with space.lock:
+            for name in command_set:
+                if name in self.builtin_command_dict:
+                    await self.send_to_channel(trigger.channel, trigger, f'Built-in commands cannot be {participle}.')
+                    return False
+                if name not in space.custom_command_dict:
+                    await self.send_to_channel(trigger.channel, trigger, f'Unknown command in this space: `{name}`')
+                    return False
+                author_id = space.custom_command_dict[name].author
+                if author_id and author_id != trigger.author.id and not space.is_moderator(trigger.author) and await self.user_exists(author_id, trigger.channel):
+                    await self.send_to_channel(trigger.channel, trigger, f'The command `{name}` blongs to <@!{author_id}>. You cannot {verb} it.')
+                    return False
+            batch = CommandBatch(space)
+            for name in command_set:
+                batch.set_author(name, give_id)
+            success = await batch.commit()
+        msg = f'Command ownership transfered successfully for: `{", ".join(batch.names())}`' if success else 'Unknown error when evaluating command'
         await self.send_to_channel(trigger.channel, trigger, msg)
         return success
 
@@ -338,9 +381,83 @@ class DeepBlueSky(discord.Client):
         return True
 
     async def say(self, trigger: discord.Message, space: Space, command_name: str, command_predicate: Optional[str], processor: Callable[[str], str] = identity) -> bool:
-        msg = f'Message may not be empty\nUsage: `{command_name}` <message>' if not command_predicate else processor(command_predicate)
-        await self.send_to_channel(trigger.channel, trigger, msg)
-        return command_predicate is not None
+        if not command_predicate:
+            await self.send_to_channel(trigger.channel, trigger, f'Message may not be empty\nUsage: `{command_name}` <message>')
+            return command_predicate is not None
+        reply_to: Optional[discord.Message] = trigger
+        for chunk in split_message(processor(command_predicate)):
+            await self.send_to_channel(trigger.channel, reply_to, chunk)
+            reply_to = None
+        return True
+
+    async def transform(self, trigger: discord.Message, space: Space, command_name: str, command_predicate: Optional[str]) -> bool:
+        usage = f'Usage: `{command_name}` <transform[|transform...]> <message>\nTransforms: {", ".join(f"`{name}`" for name in TRANSFORMS)}'
+        spec, message = split_command(command_predicate)
+        if not spec or not message:
+            await self.send_to_channel(trigger.channel, trigger, f'Transform and message may not be empty\n{usage}')
+            return False
+        try:
+            pipeline = compile_pipeline(spec)
+        except ValueError as ex:
+            await self.send_to_channel(trigger.channel, trigger, f'{ex}\n{usage}')
+            return False
+        return await self.say(trigger, space, command_name, message, processor=pipeline)
+
+    async def top_commands(self, trigger: discord.Message, space: Space, command_name: str, command_predicate: Optional[str]) -> bool:
+        usage = f'Usage: `{command_name}` [count]'
+        limit = 10
+        if command_predicate:
+            try:
+                limit = int(command_predicate)
+            except ValueError:
+                await self.send_to_channel(trigger.channel, trigger, f'`count` must be an integer\n{usage}')
+                return False
+            if not 1 <= limit <= 25:
+                await self.send_to_channel(trigger.channel, trigger, f'`count` must be between 1 and 25\n{usage}')
+                return False
+        top = self.usage.top_commands(space.space_id, limit=limit)
+        if not top:
+            await self.send_to_channel(trigger.channel, trigger, 'No commands have been called in this space yet.')
+            return True
+        lines = [f'`{name}`: {calls} {pluralize(calls, "call")}, last <t:{last_used}:R>' for name, calls, last_used in top]
+        await self.send_to_channel(trigger.channel, trigger, '\n'.join(lines))
+        return True
+
+    # load the values of the most called commands into the value cache
+    # the hottest go in last so they are the last to be evicted
+    async def warm_command_cache(self, batch_size: int = 64):
+        loop = asyncio.get_running_loop()
+        commands = []
+        for space_id, name in reversed(self.usage.hottest(CommandSimple.value_cache.maxsize)):
+            space = self.spaces.get(space_id)
+            command = space.custom_command_dict.get(name) if space else None
+            if isinstance(command, CommandSimple) and not command.is_resident():
+                commands.append(command)
+        warmed = 0
+        with timeline.measure('command cache warm-up'):
+            for i in range(0, len(commands), batch_size):
+                batch = commands[i:i+batch_size]
+                generations = [command.generation for command in batch]
+                # the files are read off the event loop, the cache is only touched on it
+                values = await loop.run_in_executor(None, self._load_command_values0, batch)
+                for command, value, generation in zip(batch, values, generations):
+                    # commands changed in the meantime already have their new value cached
+                    if value is not None and command.cache_loaded_value(value, generation):
+                        warmed += 1
+                        if isinstance(command, CommandTemplate):
+                            command.compiled()
+        self.logger.info(f'Warmed up {warmed} command values')
+
+    # a command whose file is missing or broken is left out, the rest are still warmed up
+    def _load_command_values0(self, batch: List[CommandSimple]) -> List[Optional[str]]:
+        values: List[Optional[str]] = []
+        for command in batch:
+            try:
+                values.append(command.space.load_command_value(command.name))
+            except (IOError, ValueError, KeyError):
+                self.logger.warning(f'Unable to warm up command {command.name} in {command.space.space_id}', exc_info=True)
+                values.append(None)
+        return values
 
     async def search(self, trigger: discord.Message, space: Space, command_name: str, command_predicate: Optional[str]) -> bool:
         usage = f'Usage: `{command_name}` <command_name> [page_number]'
@@ -387,26 +504,35 @@ class DeepBlueSky(discord.Client):
         return True
 
     async def get_time(self, trigger: discord.Message, space: Space, command_name: str, command_predicate: Optional[str]) -> bool:
-        usage = f'Usage: `{command_name}` [time]'
-        if not command_predicate:
-            dt = datetime.datetime.now(datetime.timezone.utc)
-        else:
-            with warnings.catch_warnings() as w:
-                warnings.filterwarnings('error')
-                try:
-                    timestring = command_predicate.replace('+', '\x01').replace('-', '+').replace('\x01', '-')
-                    dt = dateutil.parser.parse(timestring)
-                except dateutil.parser._parser.UnknownTimezoneWarning:
-                    await self.send_to_channel(trigger.channel, trigger, f'Unknown Timezone. Use UTC offsets.\n{usage}')
-                    return False
-                except dateutil.parser._parser.ParserError:
-                    await self.send_to_channel(trigger.channel, trigger, f'Could not parse given time.\n{usage}')
-                    return False
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=datetime.timezone.utc)
-        timestamp = int(dt.timestamp())
-        await self.send_to_channel(trigger.channel, trigger, f'Unix Time: `{timestamp}` <t:{timestamp}>')
-        return True
+        usage = f'Usage: `{command_name}` [time[; time...]]'
+        timestrings = [timestring.strip() for timestring in re.split(r'[;\n]', command_predicate or '')]
+        timestrings = [timestring for timestring in timestrings if timestring] or ['']
+        if len(timestrings) > 25:
+            await self.send_to_channel(trigger.channel, trigger, f'Maximum 25 times may be converted at once.\n{usage}')
+            return False
+        now = datetime.datetime.now(datetime.timezone.utc)
+        lines = []
+        success = True
+        for timestring in timestrings:
+            prefix = f'`{timestring}`: ' if len(timestrings) > 1 else ''
+            try:
+                timestamp = int(parse_time(timestring, now=now).timestamp())
+            except UnknownTimezoneError:
+                lines.append(f'{prefix}Unknown Timezone. Use UTC offsets.')
+                success = False
+                continue
+            except (ValueError, OverflowError):
+                lines.append(f'{prefix}Could not parse given time.')
+                success = False
+                continue
+            lines.append(f'{prefix}Unix Time: `{timestamp}` <t:{timestamp}>')
+        if not success and len(timestrings) == 1:
+            lines.append(usage)
+        reply_to: Optional[discord.Message] = trigger
+        for chunk in split_message('\n'.join(lines)):
+            await self.send_to_channel(trigger.channel, reply_to, chunk)
+            reply_to = None
+        return success
 
     async def markdown(self, trigger: discord.Message, space: Space, command_name: str, command_predicate: Optional[str]) -> bool:
         usage = f'Usage: `{command_name}` <command_name>'
@@ -430,24 +556,102 @@ class DeepBlueSky(discord.Client):
             if not command:
                 await self.send_to_channel(trigger.channel, trigger, f'Unknown command in this space: `{name}`')
                 return False
-            if command.command_type != 'simple':
+            if not isinstance(command, CommandSimple):
                 await self.send_to_channel(trigger.channel, trigger, f'Only simple commands can be attached.')
                 return False
             commands += [self.find_command(space, name, follow_alias=False)]
-        files = [discord.File(io.BytesIO(command.canonical().value.encode()), filename=(command.name + '.markdown')) for command in commands]
+        files = [discord.File(io.BytesIO((await command.canonical().get_value()).encode()), filename=(command.name + '.markdown')) for command in commands]
         await self.send_to_channel(trigger.channel, trigger, content=None, attachments=files)
         return True
 
+    async def profile(self, trigger: discord.Message, space: Space, command_name: str, command_predicate: Optional[str]) -> bool:
+        usage = f'Usage: `{command_name}` [seconds] [sample | cprofile]'
+        duration: float = 30.0
+        mode = 'sample'
+        for arg in (command_predicate or '').split():
+            if arg in ('sample', 'cprofile'):
+                mode = arg
+                continue
+            try:
+                duration = float(arg)
+            except ValueError:
+                await self.send_to_channel(trigger.channel, trigger, f'Invalid argument: `{arg}`\n{usage}')
+                return False
+        if not 0 < duration <= 600:
+            await self.send_to_channel(trigger.channel, trigger, f'Profile duration must be between 0 and 600 seconds.\n{usage}')
+            return False
+        if self.profiling:
+            await self.send_to_channel(trigger.channel, trigger, 'A profile is already running.')
+            return False
+        self.profiling = True
+        try:
+            await self.send_to_channel(trigger.channel, trigger, f'Profiling the event loop for {duration:g} seconds ({mode}).')
+            self.logger.info(f'Starting {mode} profile for {duration:g} seconds')
+            if mode == 'sample':
+                profiler = await sample_event_loop(duration)
+                files = [discord.File(io.BytesIO(profiler.collapsed().encode()), filename=profile_filename('sample', 'collapsed'))]
+                msg = f'{profiler.sample_count} samples, {len(profiler.samples)} distinct stacks.'
+            else:
+                stats_data, stats_text = await cprofile_event_loop(duration)
+                files = [discord.File(io.BytesIO(stats_data), filename=profile_filename('cprofile', 'prof')),
+                    discord.File(io.BytesIO(stats_text.encode()), filename=profile_filename('cprofile', 'txt'))]
+                msg = 'cProfile stats attached.'
+        finally:
+            self.profiling = False
+        await self.send_to_channel(trigger.channel, trigger, msg, attachments=files)
+        return True
+
+    async def memory(self, trigger: discord.Message, space: Space, command_name: str, command_predicate: Optional[str]) -> bool:
+        usage = f'Usage: `{command_name}` [start [frames] | diff | stop]'
+        action, remainder = split_command(command_predicate)
+        if not action:
+            await self.send_to_channel(trigger.channel, trigger, memory_report(self))
+            return True
+        if action == 'start':
+            frames = 1
+            if remainder:
+                try:
+                    frames = int(remainder)
+                except ValueError:
+                    await self.send_to_channel(trigger.channel, trigger, f'`frames` must be an integer\n{usage}')
+                    return False
+                if not 1 <= frames <= 64:
+                    await self.send_to_channel(trigger.channel, trigger, f'`frames` must be between 1 and 64\n{usage}')
+                    return False
+            self.tracemalloc.start(frames)
+            await self.send_to_channel(trigger.channel, trigger, 'Tracing allocations. Use `diff` to see what changed since now.')
+            return True
+        if action in ('diff', 'stop'):
+            if not self.tracemalloc.is_running():
+                await self.send_to_channel(trigger.channel, trigger, f'Not tracing allocations.\n{usage}')
+                return False
+            if action == 'stop':
+                self.tracemalloc.stop()
+                await self.send_to_channel(trigger.channel, trigger, 'Stopped tracing allocations.')
+                return True
+            # snapshots of a big process take a while
+            report = await asyncio.get_running_loop().run_in_executor(None, self.tracemalloc.diff)
+            files = [discord.File(io.BytesIO(report.encode()), filename=profile_filename('tracemalloc', 'txt'))]
+            await self.send_to_channel(trigger.channel, trigger, report.split('\n', 1)[0], attachments=files)
+            return True
+        await self.send_to_channel(trigger.channel, trigger, f'Unknown action: `{action}`\n{usage}')
+        return False
+
+    async def is_bot_owner(self, user: discord.abc.User) -> bool:
+        if self.owner_ids is None:
+            try:
+                app_info = await self.application_info()
+            except discord.HTTPException:
+                self.logger.exception('Could not fetch application info')
+                return False
+            if app_info.team:
+                self.owner_ids = frozenset(member.id for member in app_info.team.members)
+            else:
+                self.owner_ids = frozenset({app_info.owner.id})
+        return user.id in self.owner_ids
+
     def get_message_space(self, message: discord.Message) -> Space:
-        if message.channel.type == discord.ChannelType.private:
-            return self.get_dm_space(message.author.id)
-        if message.channel.type == discord.ChannelType.group:
-            return self.get_channel_space(message.channel.id)
-        if hasattr(message.channel, 'guild'):
-            return self.get_guild_space(message.channel.guild.id)
-        msg = f'Uknown space for message: {message.id}'
-        self.logger.critical(msg)
-        raise ValueError(msg)
+        return self.get_space(self.get_message_space_id(message))
 
     def get_dm_space(self, base_id: int) -> Space:
         space_id = f'dm_{base_id}'
@@ -484,28 +688,81 @@ class DeepBlueSky(discord.Client):
             return self.get_guild_space(base_id)
         raise ValueError(f'Invalid space_id: {space_id}')
 
+    # when running a subset of the shards
+    # each process only owns the spaces for its own shards
+    # discord sends direct messages to shard 0
+    def owns_space(self, space_id: str) -> bool:
+        if self.shard_ids is None or self.shard_count is None:
+            return True
+        if space_id.startswith('guild_'):
+            base_id = int(removeprefix(space_id, 'guild_'))
+            return (base_id >> 22) % self.shard_count in self.shard_ids
+        return 0 in self.shard_ids
+
+    # the properties, if the space has any, and the commands of a space in storage
+    # with the names of the commands whose file is not named after them
+    def read_space_files(self, space_id: str) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]], Set[str]]:
+        space_json = None
+        space_json_fname = f'storage/{space_id}/space.json'
+        if os.path.isfile(space_json_fname):
+            with open(space_json_fname, 'r', encoding='UTF-8') as json_file:
+                space_json = load_json(json_file)
+        commands = []
+        misplaced: Set[str] = set()
+        if os.path.isdir(f'storage/{space_id}/commands/'):
+            for command_json_fname in os.listdir(f'storage/{space_id}/commands/'):
+                # left behind if the bot stopped in the middle of saving
+                if not command_json_fname.endswith('.json'):
+                    continue
+                with open(f'storage/{space_id}/commands/{command_json_fname}', encoding='UTF-8') as json_file:
+                    try:
+                        command_json = load_json(json_file)
+                        commands += [command_json]
+                    except json.decoder.JSONDecodeError:
+                        self.logger.error(f'Corrupt command json: {command_json_fname} in {space_id}')
+                        continue
+                if f'{command_json["name"]}.json' != command_json_fname:
+                    self.logger.warning(f'Command json {command_json_fname} in {space_id} holds the command: {command_json["name"]}')
+                    misplaced.add(command_json['name'])
+        return (space_json, commands, misplaced)
+
     def _load_space_overrides0(self) -> bool:
         for space_id in os.listdir('storage/'):
+            if not self.owns_space(space_id):
+                continue
             space = self.get_space(space_id)
-            space_json_fname = f'storage/{space_id}/space.json'
-            if os.path.isfile(space_json_fname):
-                with open(space_json_fname, 'r', encoding='UTF-8') as json_file:
-                    space_json = json.load(json_file)
-                    space.load_properties(space_json)
-            commands = []
-            if os.path.isdir(f'storage/{space_id}/commands/'):
-                for command_json_fname in os.listdir(f'storage/{space_id}/commands/'):
-                    with open(f'storage/{space_id}/commands/{command_json_fname}', encoding='UTF-8') as json_file:
-                        try:
-                            command_json = json.load(json_file)
-                            commands += [command_json]
-                        except json.decoder.JSONDecodeError:
-                            self.logger.error(f'Corrupt command json: {command_json_fname} in {space_id}')
-            if not space.load_commands(commands):
+            space_json, commands, misplaced = self.read_space_files(space_id)
+            if space_json is not None:
+                space.load_properties(space_json)
+            if not space.load_commands(commands, misplaced):
                 self.logger.error(f'Unable to load commands from space: {space_id}')
                 return False
         return True
 
+    # replaces everything in memory about a space with what is in storage
+    async def reload_space(self, space_id: str) -> bool:
+        if not self.owns_space(space_id):
+            return False
+        async with self.get_space(space_id).lock:
+            return await self._reload_space0(space_id)
+
+    # with the lock of the space held
+    async def _reload_space0(self, space_id: str) -> bool:
+        space = self.get_space(space_id)
+        space_json, commands, misplaced = await asyncio.get_running_loop().run_in_executor(None, self.read_space_files, space_id)
+        space.clear_commands()
+        space.load_properties(space_json if space_json is not None else {})
+        success = space.load_commands(commands, misplaced)
+        if success:
+            self.logger.info(f'Reloaded space {space_id} with {pluralize(len(space.custom_command_dict), "command")}')
+        else:
+            self.logger.error(f'Unable to load commands from space: {space_id}')
+        return success
+
+    def storage_written(self, path: str):
+        if self.storage_watcher:
+            self.storage_watcher.written(path)
+
     def load_space_overrides(self) -> bool:
         try:
             return self._load_space_overrides0()
@@ -616,6 +873,42 @@ class DeepBlueSky(discord.Client):
             return None
         return member_obj
 
+    # used instead of the member cache when guilds are not chunked at startup
+    # discord only searches by name, so a name#discriminator query asks for as many as it allows
+    async def query_guild_members(self, guild: discord.Guild, query: str) -> FrozenSet[discord.Member]:
+        query = query.split('#', maxsplit=1)[0].lower()
+        if not query:
+            return frozenset()
+        key = (guild.id, query)
+        cached = self.member_query_cache.get(key)
+        if cached and time.monotonic() - cached[0] < self.member_query_ttl:
+            return cached[1]
+        try:
+            members = frozenset(await guild.query_members(query=query, limit=100, cache=False))
+        except (asyncio.TimeoutError, discord.ClientException):
+            self.logger.exception(f'Could not query members of guild: {guild.id}')
+            return frozenset(guild.members)
+        self.member_query_cache.put(key, (time.monotonic(), members))
+        return members
+
+    def chunk_if_active(self, guild: Optional[discord.Guild]):
+        if self.chunk_active_guilds and guild:
+            self.chunk_in_background(guild)
+
+    def chunk_in_background(self, guild: discord.Guild):
+        if guild.chunked or guild.id in self.chunking_guilds:
+            return
+        self.chunking_guilds.add(guild.id)
+        async def _chunk():
+            try:
+                self.logger.info(f'Chunking guild: {guild.id}')
+                await guild.chunk(cache=True)
+            except (asyncio.TimeoutError, discord.ClientException):
+                self.logger.exception(f'Could not chunk guild: {guild.id}')
+            finally:
+                self.chunking_guilds.discard(guild.id)
+        asyncio.create_task(_chunk())
+
     async def process_command(self, trigger: discord.Message, space: Space, command_string: str) -> bool:
         if not re.match(r'^[a-z_\-\.][a-z0-9_\-\.!?]*', command_string):
             return False
@@ -624,10 +917,22 @@ class DeepBlueSky(discord.Client):
             return False
         command = self.find_command(space, command_name, follow_alias=True)
         if command:
+            if self.loop_monitor:
+                self.loop_monitor.activity = f'command {command.name} from {trigger.author.id} in {space}'
             return await command.invoke(trigger, space, command_name, command_predicate)
-        await self.send_to_channel(trigger.channel, trigger, f'Unknown command in this space: `{command_name}`')
+        msg = f'Unknown command in this space: `{command_name}`'
+        suggestions = await self.suggest_commands(space, command_name)
+        if suggestions:
+            msg += f'\nDid you mean: {", ".join(f"`{name}`" for name in suggestions)}?'
+        await self.send_to_channel(trigger.channel, trigger, msg)
         return False
 
+    async def suggest_commands(self, space: Space, command_name: str, limit: int = 3) -> List[str]:
+        space_index = await space.get_name_index()
+        matches = self.builtin_name_index.search(command_name, limit=limit) + space_index.search(command_name, limit=limit)
+        matches.sort()
+        return [name for _, name in matches[:limit]]
+
     # wikitext stuff
 
     async def set_wikitext(self, trigger: discord.Message, space: Space, command_name: str, command_predicate: Optional[str]) -> bool:
@@ -663,61 +968,293 @@ class DeepBlueSky(discord.Client):
         return success
 
     async def handle_wiki_lookup(self, trigger: discord.Message, extra_wikis: List[str]):
-        chunks = get_all_noncode_chunks(trigger.content)
-        article_chunks = [re.findall(r'\[\[(.*?)\]\]', chunk) for chunk in chunks]
-        articles = [article for chunk in article_chunks for article in chunk if len(article.strip()) > 0]
+        articles = find_articles(trigger.content)
         if len(articles) > 0:
-            await self.send_to_channel(trigger.channel, trigger, '\n'.join([lookup_wikis(article, extra_wikis=extra_wikis) for article in articles]))
+            wiki_reply = WikiReply()
+            self.wiki_replies.put(trigger.id, wiki_reply)
+            await self.update_wiki_reply(trigger, wiki_reply, articles, extra_wikis)
             return True
         return False
 
+    # lookups block on http, so they run in their own executor
+    # a cancelled lookup still finishes in its thread, but its result is dropped
+    async def update_wiki_reply(self, trigger: discord.Message, wiki_reply: WikiReply, articles: List[str], extra_wikis: List[str]):
+        loop = asyncio.get_running_loop()
+        for article in set(wiki_reply.lookups) - set(articles):
+            wiki_reply.lookups.pop(article).cancel()
+        for article in articles:
+            if article not in wiki_reply.lookups:
+                wiki_reply.lookups[article] = loop.run_in_executor(self.wiki_executor, functools.partial(lookup_wikis, article, extra_wikis=extra_wikis, timeout=self.wiki_timeout))
+        wiki_reply.articles = articles
+        wiki_reply.generation += 1
+        generation = wiki_reply.generation
+        deadline = loop.time() + self.wiki_timeout
+        pending = {wiki_reply.lookups[article] for article in articles}
+        # progressive replies go out with the first result and are edited as more arrive
+        # at most once every wiki_edit_interval seconds
+        return_when = asyncio.FIRST_COMPLETED if self.wiki_progressive else asyncio.ALL_COMPLETED
+        while pending:
+            _, pending = await asyncio.wait(pending, timeout=max(0.0, deadline - loop.time()), return_when=return_when)
+            # a later edit replies with its own articles
+            if generation != wiki_reply.generation:
+                return
+            if not pending or loop.time() >= deadline:
+                break
+            await self.send_wiki_reply(trigger, wiki_reply, generation, final=False)
+            await asyncio.sleep(min(self.wiki_edit_interval, max(0.0, deadline - loop.time())))
+            pending = {lookup for lookup in pending if not lookup.done()}
+        for article in articles:
+            lookup = wiki_reply.lookups.get(article)
+            if lookup is not None and not lookup.done():
+                self.logger.warning(f'Timed out looking up article: {article}')
+        await self.send_wiki_reply(trigger, wiki_reply, generation, final=True)
+        # so an edit that keeps the article looks it up again
+        if generation != wiki_reply.generation:
+            return
+        for article in articles:
+            lookup = wiki_reply.lookups.get(article)
+            if lookup is not None and not lookup.done():
+                wiki_reply.lookups.pop(article).cancel()
+
+    def format_wiki_result(self, article: str, lookup: asyncio.Future, final: bool) -> str:
+        if not lookup.done() or lookup.cancelled():
+            return f'Timed out looking up article: `{article}`' if final else f'Looking up article: `{article}`…'
+        ex = lookup.exception()
+        if ex is not None:
+            if final:
+                self.logger.error(f'Unable to look up article: {article}', exc_info=ex)
+            return f'Error looking up article: `{article}`'
+        return lookup.result()
+
+    async def send_wiki_reply(self, trigger: discord.Message, wiki_reply: WikiReply, generation: int, final: bool):
+        async with wiki_reply.lock:
+            if generation != wiki_reply.generation:
+                return
+            content = '\n'.join(self.format_wiki_result(article, wiki_reply.lookups[article], final) for article in wiki_reply.articles)
+            if wiki_reply.reply is None:
+                wiki_reply.reply = await self.send_to_channel(trigger.channel, trigger, content)
+            elif wiki_reply.reply.content != content:
+                try:
+                    wiki_reply.reply = await wiki_reply.reply.edit(content=content)
+                except discord.NotFound:
+                    # deleted by someone else, the next edit of the message replies again
+                    wiki_reply.reply = None
+
+    # return value
+    # True: updated or removed the reply to the edited message
+    # False: ignored the edit
+    async def handle_message_edit(self, before: discord.Message, after: discord.Message) -> bool:
+        if after.author == self.user or after.author.bot:
+            return False
+        # discord also edits messages to add link embeds, which leaves the content alone
+        if before.content == after.content:
+            return False
+        wiki_reply = self.wiki_replies.get(after.id)
+        if wiki_reply is None:
+            # an edit that adds the first article is handled like a new message
+            # but once the reply is forgotten, editing a message that had articles does nothing
+            if find_articles(before.content):
+                return False
+            space = self.spaces.get(self.get_message_space_id(after))
+            if not (self.get_property(space, 'wikitext') if space else self.default_properties['wikitext']):
+                return False
+            return await self.handle_wiki_lookup(after, self.extra_wikis)
+        articles = find_articles(after.content)
+        if articles == wiki_reply.articles:
+            return False
+        if not articles:
+            self.wiki_replies.pop(after.id)
+            for lookup in wiki_reply.lookups.values():
+                lookup.cancel()
+            wiki_reply.generation += 1
+            async with wiki_reply.lock:
+                if wiki_reply.reply is not None:
+                    try:
+                        await wiki_reply.reply.delete()
+                    except discord.NotFound:
+                        pass
+                    wiki_reply.reply = None
+            return True
+        await self.update_wiki_reply(after, wiki_reply, articles, self.extra_wikis)
+        return True
+
     # events
 
     # return value
     # True: attempted to respond to the message
     # False: ignored the message
     async def handle_message(self, trigger: discord.Message) -> bool:
+        handled = await self._handle_message0(trigger)
+        if handled and not self.first_message_handled:
+            self.first_message_handled = True
+            timeline.mark('first message handled')
+            timeline.report(self.logger)
+        return handled
+
+    # prefixes and wikitext settings change rarely, so the filter is rebuilt on the next message
+    def invalidate_message_filter(self):
+        self.message_filter = None
+
+    def build_message_filter(self) -> Tuple[re.Pattern, bool]:
+        spaces = list(self.spaces.values())
+        prefixes = {self.default_properties['command_prefix']} | {space.command_prefix for space in spaces if space.command_prefix}
+        # longest first, so a prefix that starts with another one still matches
+        pattern = re.compile(r'\s*(?:' + '|'.join(re.escape(prefix) for prefix in sorted(prefixes, key=len, reverse=True)) + ')')
+        wikitext = bool(self.default_properties['wikitext']) or any(space.wikitext for space in spaces)
+        return (pattern, wikitext)
+
+    def get_message_space_id(self, message: discord.Message) -> str:
+        if message.channel.type == discord.ChannelType.private:
+            return f'dm_{message.author.id}'
+        if message.channel.type == discord.ChannelType.group:
+            return f'chan_{message.channel.id}'
+        if message.guild:
+            return f'guild_{message.guild.id}'
+        # the channel of a guild that is not cached, e.g. if fetching it after a RESUME failed
+        if isinstance(message.channel, discord.PartialMessageable) and message.channel.guild_id:
+            return f'guild_{message.channel.guild_id}'
+        msg = f'Uknown space for message: {message.id}'
+        self.logger.critical(msg)
+        raise ValueError(msg)
+
+    async def _handle_message0(self, trigger: discord.Message) -> bool:
         if trigger.author == self.user:
             return False
         if trigger.author.bot:
             return False
+        # most messages are neither commands nor wikitext, so turn them away
+        # before looking up, or creating, the space they belong to
+        if self.message_filter is None:
+            self.message_filter = self.build_message_filter()
+        prefix_pattern, wikitext_possible = self.message_filter
+        if not prefix_pattern.match(trigger.content) and not (wikitext_possible and '[[' in trigger.content):
+            filtered_messages.inc('reject')
+            return False
+        filtered_messages.inc('pass')
         content = trigger.content.strip()
-        space = self.get_message_space(trigger)
-        prefix = self.get_property(space, 'command_prefix')
+        space_id = self.get_message_space_id(trigger)
+        # spaces that do not exist yet have the default properties
+        space = self.spaces.get(space_id)
+        space_messages.inc(space_id)
+        if self.loop_monitor:
+            self.loop_monitor.activity = f'message {trigger.id} from {trigger.author.id} in {space_id}'
+        prefix = self.get_property(space, 'command_prefix') if space else self.default_properties['command_prefix']
         if content.startswith(prefix):
             command_string = removeprefix(content, prefix)
-            await self.process_command(trigger, space, command_string)
+            self.chunk_if_active(trigger.guild)
+            await self.process_command(trigger, space or self.get_space(space_id), command_string)
             return True
-        if self.get_property(space, 'wikitext'):
+        if self.get_property(space, 'wikitext') if space else self.default_properties['wikitext']:
             return await self.handle_wiki_lookup(trigger, self.extra_wikis)
         return False
 
     # setup stuff
 
-    def __init__(self, *args, bot_name: str, bot_storage_area: str = '~/.config/deep-blue-sky', **kwargs):
+    # chunk_guilds_at_startup=False resolves members on demand instead
+    # chunk_active_guilds then chunks a guild once it starts using the bot
+    def __init__(self, *args, bot_name: str, bot_storage_area: str = '~/.config/deep-blue-sky', command_cache_size: int = 4096, chunk_guilds_at_startup: bool = True, chunk_active_guilds: bool = False, metrics_port: Optional[int] = None, metrics_host: str = '127.0.0.1', loop_lag_threshold: Optional[float] = 0.5, log_max_bytes: int = 16 * 1024 * 1024, log_backup_count: int = 5, log_rotate_when: Optional[str] = None, log_json: bool = False, log_stderr: bool = False, resume_sessions: bool = True, session_max_age: float = 120.0, dispatch: str = 'messages', intent_profile: str = 'full', wiki_timeout: float = 30.0, wiki_progressive: bool = False, watch_storage: bool = False, **kwargs):
 
+        timeline.mark('client init')
         self.bot_name = bot_name
         self.bot_dir = os.path.expanduser(f'{bot_storage_area}/{bot_name}')
-        os.makedirs(self.bot_dir, mode=0o755, exist_ok=True)
-        os.chdir(self.bot_dir)
-        for subdir in 'feed', 'storage':
-            os.makedirs(f'{self.bot_dir}/{subdir}', mode=0o755, exist_ok=True)
+        with timeline.measure('storage directories'):
+            os.makedirs(self.bot_dir, mode=0o755, exist_ok=True)
+            os.chdir(self.bot_dir)
+            for subdir in 'feed', 'storage':
+                os.makedirs(f'{self.bot_dir}/{subdir}', mode=0o755, exist_ok=True)
 
         self.logger = logging.getLogger('discord')
         self.logger.setLevel(logging.INFO)
-        # pylint: disable=consider-using-with
-        self.log_file = open('bot_output.log', mode='a', buffering=1, encoding='UTF-8')
-        handler = logging.StreamHandler(stream=self.log_file)
-        formatter = logging.Formatter(fmt='[{asctime}] {levelname}: {message}', style='{')
-        formatter.converter = time.gmtime # type: ignore
-        handler.setFormatter(formatter)
-        self.logger.addHandler(handler)
-        intents = discord.Intents.default()
-        # pylint: disable=assigning-non-slot
-        intents.members = True
-        intents.message_content = True
-        super().__init__(*args, allowed_mentions=discord.AllowedMentions.none(), intents=intents, chunk_guilds_at_startup=True, **kwargs)
+        self.log_pipeline = self._setup_logging(kwargs.get('shard_ids'), max_bytes=log_max_bytes, backup_count=log_backup_count, rotate_when=log_rotate_when, json_format=log_json, log_stderr=log_stderr)
+        intents = self._select_intents(dispatch, intent_profile)
+        # without the member list, names are looked up with member queries instead
+        if not intents.members and (chunk_guilds_at_startup or chunk_active_guilds):
+            self.logger.info(f'Intent profile {intent_profile} has no member list, guilds will not be chunked')
+            chunk_guilds_at_startup = False
+            chunk_active_guilds = False
+        self.intent_profile = intent_profile
+        super().__init__(*args, allowed_mentions=discord.AllowedMentions.none(), intents=intents, chunk_guilds_at_startup=chunk_guilds_at_startup, **kwargs)
+        self.chunk_guilds_at_startup = chunk_guilds_at_startup
+        self.chunk_active_guilds = chunk_active_guilds
+        self.chunking_guilds: Set[int] = set()
+        self.member_query_cache = LRUCache(maxsize=1024)
+        self.member_query_ttl: float = 300.0
+        self.message_filter: Optional[Tuple[re.Pattern, bool]] = None
+        self.wiki_replies = LRUCache(maxsize=1024)
+        self.wiki_timeout = wiki_timeout
+        self.wiki_progressive = wiki_progressive
+        self.wiki_edit_interval: float = 1.0
+        # lookups that hang only hold up other lookups, not the storage and command value reads
+        self.wiki_executor = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix='wiki')
+        self.session_store = SessionStore(self.logger, max_age=session_max_age) if resume_sessions else None
+        self.fetching_guilds: Dict[int, List[Dict[str, Any]]] = {}
+        self._check_session_internals()
+        self._install_parsers()
+        self._setup_builtin_commands()
+        self.interactions = InteractionDispatcher(self, self.logger) if dispatch != 'messages' else None
+        self.default_properties: Dict[str, Any] = {
+            'space_id' : 'default',
+            'command_prefix' : '--',
+            'wikitext' : False,
+        }
+        self.extra_wikis: List[str] = []
+        self.spaces: Dict[str, Space] = {}
+        self.first_message_handled = False
+        self.owner_ids: Optional[FrozenSet[int]] = None
+        self.profiling = False
+        self.closing = False
+        self.warm_task: Optional[asyncio.Task] = None
+        self.tracemalloc = TracemallocSession()
+        self._load_storage(command_cache_size, watch_storage)
+        self._setup_monitoring(metrics_host, metrics_port, loop_lag_threshold)
+
+    # processes started by the launcher each rotate their own file
+    def _setup_logging(self, shard_ids: Optional[List[int]], **options) -> LogPipeline:
+        log_filename = 'bot_output.log' if shard_ids is None else f'bot_output.{"_".join(str(shard_id) for shard_id in shard_ids)}.log'
+        log_pipeline = setup_logging(self.logger, filename=log_filename, **options)
+        timeline.mark('logging ready')
+        self.logger.info(f'Using event loop: {event_loop_name()}, JSON: {json_backend().describe()}')
+        return log_pipeline
+
+    def _select_intents(self, dispatch: str, intent_profile: str) -> discord.Intents:
+        if dispatch not in ('messages', 'interactions', 'both'):
+            raise ValueError(f'Invalid dispatch mode: {dispatch}')
+        intents = profile_intents(intent_profile, dispatch)
+        if not intents.guild_messages:
+            if dispatch == 'messages':
+                raise ValueError(f'Intent profile {intent_profile} receives no messages, so it needs slash commands')
+            self.logger.warning(f'Intent profile {intent_profile} receives no messages, only slash commands will work')
+        return intents
+
+    # resuming saved sessions and fetching guilds missing from the cache reach into discord.py internals,
+    # which can change in any release, so whatever is missing is turned off with a warning instead
+    def _check_session_internals(self):
+        missing = [name for name, present in (
+            ('AutoShardedClient.__shards', hasattr(self, '_AutoShardedClient__shards')),
+            ('discord.shard.Shard', hasattr(discord.shard, 'Shard') and hasattr(discord.shard.Shard, 'launch') and hasattr(discord.shard.Shard, '_cancel_task')),
+            ('discord.shard.ShardInfo._parent', hasattr(discord.shard.ShardInfo, '_parent')),
+            ('DiscordWebSocket.from_client', hasattr(discord.gateway.DiscordWebSocket, 'from_client')),
+        ) if not present]
+        if missing and self.session_store:
+            self.logger.warning(f'discord.py {discord.__version__} is missing {", ".join(missing)}, sessions will not be resumed')
+            self.session_store = None
+
+    def _install_parsers(self):
+        # pylint: disable=protected-access
+        parsers = getattr(self._connection, 'parsers', None)
+        if not isinstance(parsers, dict) or 'MESSAGE_CREATE' not in parsers:
+            self.logger.warning(f'discord.py {discord.__version__} has no gateway parsers to hook, gateway events will not be counted')
+            return
+        if hasattr(self._connection, '_get_guild') and hasattr(self._connection, '_add_guild_from_data'):
+            self._message_create_parser = parsers['MESSAGE_CREATE']
+            parsers['MESSAGE_CREATE'] = self._parse_message_create
+        else:
+            self.logger.warning(f'discord.py {discord.__version__} cannot add guilds to the cache, messages from guilds missing from it after a resume are dropped')
+        # count what the gateway sends, to see what each intent profile saves
+        for event, parser in list(parsers.items()):
+            parsers[event] = functools.partial(self._count_event, event, parser)
 
+    def _setup_builtin_commands(self):
         builtin_list = [
             CommandFunction(name='help', value=self.send_help, helpstring='Print help messages'),
             CommandSimple(name='ping', value='pong', builtin=True, helpstring='Reply with pong'),
@@ -726,6 +1263,7 @@ class DeepBlueSky(discord.Client):
             CommandFunction(name='set-wikitext', value=self.set_wikitext, helpstring='Enable or disable wikitext in this space'),
             CommandFunction(name='reset-wikitext', value=self.reset_wikitext, helpstring='Restore wikitext in this space to the default value'),
             CommandFunction(name='createcommand', value=self.create_command, helpstring='Create a new simple command in this space'),
+            CommandFunction(name='createtemplate', value=functools.partial(self.create_command, command_class=CommandTemplate), helpstring='Create a new command that fills in {args}, {1}, {2}, ..., {author} and {time}'),
             CommandFunction(name='removecommand', value=self.remove_command, helpstring='Remove a simple command and all of its aliases'),
             CommandFunction(name='updatecommand', value=self.update_command, helpstring='Change the value of a simple command'),
             CommandFunction(name='listcommands', value=self.list_commands, helpstring='List simple commands you own'),
@@ -735,11 +1273,15 @@ class DeepBlueSky(discord.Client):
             CommandFunction(name='list-all-commands', value=self.list_all_commands, helpstring='List all commands in this space (this is spammy!)'),
             CommandFunction(name='whoowns', value=self.who_owns_command, helpstring='Report who owns a simple command'),
             CommandFunction(name='say', value=self.say, helpstring='prints the text back, like echo(1)'),
-            CommandFunction(name='owo', value=functools.partial(self.say, processor=owoify), helpstring='pwints the text back, wike echo(1)'),
-            CommandFunction(name='spongebob', value=functools.partial(self.say, processor=spongebob), helpstring='pRiNtS tHe TeXt BaCk, LiKe EcHo(1)'),
+            CommandFunction(name='owo', value=functools.partial(self.say, processor=compile_pipeline('owo')), helpstring='pwints the text back, wike echo(1)'),
+            CommandFunction(name='spongebob', value=functools.partial(self.say, processor=compile_pipeline('spongebob')), helpstring='pRiNtS tHe TeXt BaCk, LiKe EcHo(1)'),
+            CommandFunction(name='transform', value=self.transform, helpstring='Prints the text back through a chain of transforms, like owo|spongebob'),
             CommandFunction(name='markdown', value=self.markdown, helpstring='Attach a simple command as a markdown file'),
             CommandFunction(name='search', value=self.search, helpstring='Search for a command by name'),
-            CommandFunction(name='time', value=self.get_time, helpstring='Convert time to Unix Time. UTC assumed if not specified.')
+            CommandFunction(name='topcommands', value=self.top_commands, helpstring='List the most called commands in this space'),
+            CommandFunction(name='time', value=self.get_time, helpstring='Convert times, separated by ; or new lines, to Unix Time. UTC assumed if not specified.'),
+            CommandFunction(name='profile', value=self.profile, helpstring='Profile the bot and attach the results (owner only)', owner_only=True),
+            CommandFunction(name='memory', value=self.memory, helpstring='Report memory use by subsystem, or attach the allocations that changed between two points in time (owner only)', owner_only=True),
         ]
 
         self.builtin_command_dict = OrderedDict([(command.name, command) for command in builtin_list])
@@ -755,6 +1297,7 @@ class DeepBlueSky(discord.Client):
             CommandAlias(name='newcommand', value=self.builtin_command_dict['createcommand']),
             CommandAlias(name='addcommand', value=self.builtin_command_dict['createcommand']),
             CommandAlias(name='addc', value=self.builtin_command_dict['createcommand']),
+            CommandAlias(name='addtemplate', value=self.builtin_command_dict['createtemplate']),
             CommandAlias(name='deletecommand', value=self.builtin_command_dict['removecommand']),
             CommandAlias(name='delc', value=self.builtin_command_dict['removecommand']),
             CommandAlias(name='renewcommand', value=self.builtin_command_dict['updatecommand']),
@@ -767,17 +1310,149 @@ class DeepBlueSky(discord.Client):
             CommandAlias(name='listallcommands', value=self.builtin_command_dict['list-all-commands']),
             CommandAlias(name='owner', value=self.builtin_command_dict['whoowns']),
             CommandAlias(name='clyde', value=self.builtin_command_dict['say']),
+            CommandAlias(name='tf', value=self.builtin_command_dict['transform']),
         ]
 
         self.builtin_command_dict.update(OrderedDict([(command.name, command) for command in alias_list]))
-        self.default_properties: Dict[str, Any] = {
-            'space_id' : 'default',
-            'command_prefix' : '--',
-            'wikitext' : False,
-        }
-        self.extra_wikis: List[str] = []
-        self.spaces: Dict[str, Space] = {}
-        self.load_space_overrides()
+        self.builtin_name_index = NameIndex(name for name, command in self.builtin_command_dict.items() if not getattr(command.canonical(), 'owner_only', False))
+
+    def _load_storage(self, command_cache_size: int, watch_storage: bool):
+        CommandSimple.value_cache.resize(command_cache_size)
+        self.usage = UsageStore(self.logger, shard_ids=self.shard_ids)
+        self.storage_watcher = StorageWatcher(self, self.logger) if watch_storage else None
+        with timeline.measure('storage load'):
+            self.usage.load(self.owns_space)
+            self.load_space_overrides()
+        self.logger.info(f'Loaded {len(self.spaces)} spaces')
+
+    def _setup_monitoring(self, metrics_host: str, metrics_port: Optional[int], loop_lag_threshold: Optional[float]):
+        self.loop_monitor = LoopMonitor(self.logger, threshold=loop_lag_threshold) if loop_lag_threshold else None
+        self.metrics_server = MetricsServer(registry, host=metrics_host, port=metrics_port) if metrics_port is not None else None
+        registry.gauge('deepbluesky_spaces', 'Loaded spaces', lambda: len(self.spaces))
+        registry.gauge('deepbluesky_custom_commands', 'Loaded custom commands', lambda: sum(len(space.custom_command_dict) for space in list(self.spaces.values())))
+        registry.gauge('deepbluesky_builtin_commands', 'Built-in commands and aliases', lambda: len(self.builtin_command_dict))
+        registry.gauge('deepbluesky_cached_command_values', 'Custom command values in the value cache', lambda: len(CommandSimple.value_cache))
+
+    # discord.py calls this once, after login
+    async def setup_hook(self) -> None:
+        if self.loop_monitor:
+            self.loop_monitor.start()
+        self.usage.start()
+        if self.storage_watcher:
+            self.storage_watcher.start()
+        # kept so the task is not collected while it runs, and can be cancelled on close
+        self.warm_task = asyncio.create_task(self.warm_command_cache())
+        if self.interactions:
+            try:
+                await self.interactions.sync()
+            except discord.HTTPException:
+                self.logger.exception('Unable to sync application commands')
+        if self.metrics_server:
+            try:
+                await self.metrics_server.start()
+                self.logger.info(f'Serving metrics on http://{self.metrics_server.host}:{self.metrics_server.port}/metrics')
+            except OSError:
+                self.logger.exception('Unable to start metrics server')
+
+    def _count_event(self, event: str, parser: Callable[[Dict[str, Any]], None], data: Dict[str, Any]):
+        gateway_events.inc(event)
+        parser(data)
+
+    def log_event_counts(self):
+        counts = sorted(gateway_events.values.items(), key=lambda item: item[1], reverse=True)
+        summary = ', '.join(f'{event}: {count:.0f}' for (event,), count in counts)
+        self.logger.info(f'Gateway events received with intent profile {self.intent_profile}: {summary or "none"}')
+
+    # after a RESUME in a new process the guild cache starts out empty
+    # so messages from a guild that is not cached wait for the guild to be fetched
+    def _parse_message_create(self, data: Dict[str, Any]):
+        guild_id = data.get('guild_id')
+        # pylint: disable=protected-access
+        if guild_id is None or self._connection._get_guild(int(guild_id)) is not None:
+            self._message_create_parser(data)
+            return
+        guild_id = int(guild_id)
+        if guild_id in self.fetching_guilds:
+            self.fetching_guilds[guild_id].append(data)
+            return
+        self.fetching_guilds[guild_id] = [data]
+        asyncio.create_task(self.fetch_guild_state(guild_id))
+
+    async def fetch_guild_state(self, guild_id: int):
+        try:
+            data = await self.http.get_guild(guild_id)
+            data['channels'] = await self.http.get_all_guild_channels(guild_id)
+            data['threads'] = (await self.http.get_active_threads(guild_id))['threads']
+            data.setdefault('member_count', data.get('approximate_member_count'))
+            # pylint: disable=protected-access
+            guild = self._connection._add_guild_from_data(data)
+            self.logger.info(f'Fetched guild missing from the cache: {guild_id}')
+            if self.chunk_guilds_at_startup:
+                self.chunk_in_background(guild)
+        except discord.HTTPException:
+            self.logger.exception(f'Could not fetch guild: {guild_id}')
+        finally:
+            for message_data in self.fetching_guilds.pop(guild_id, []):
+                self._message_create_parser(message_data)
+
+    async def launch_shard(self, gateway: yarl.URL, shard_id: int, *, initial: bool = False) -> None:
+        session = self.session_store.load(shard_id, self.shard_count) if self.session_store else None
+        # the shard queue only exists once discord.py has started launching shards
+        if session and not hasattr(self, '_AutoShardedClient__queue'):
+            self.logger.warning(f'discord.py {discord.__version__} has no shard queue, identifying shard {shard_id} instead of resuming')
+            session = None
+        if not session:
+            await super().launch_shard(gateway, shard_id, initial=initial)
+            return
+        try:
+            coro = discord.gateway.DiscordWebSocket.from_client(self, initial=initial, gateway=yarl.URL(session['resume_gateway_url']), shard_id=shard_id, session=session['session_id'], sequence=session['sequence'], resume=True)
+            ws = await asyncio.wait_for(coro, timeout=self.shard_connect_timeout)
+        except Exception: # pylint: disable=broad-except
+            self.logger.exception(f'Unable to resume shard {shard_id}, identifying instead')
+            await super().launch_shard(gateway, shard_id, initial=initial)
+            return
+        # if discord no longer accepts the session it invalidates it
+        # and the shard identifies again the same way it would after a disconnect
+        self.logger.info(f'Resuming session for shard {shard_id}')
+        # pylint: disable=protected-access
+        shard = discord.shard.Shard(ws, self, self._AutoShardedClient__queue.put_nowait)
+        self._AutoShardedClient__shards[shard_id] = shard
+        shard.launch()
+
+    # discord drops the session when the websocket is closed normally
+    # so close with a different code and keep it for the next process
+    async def save_sessions(self):
+        for shard_id, shard_info in self.shards.items():
+            # pylint: disable=protected-access
+            shard = shard_info._parent
+            ws = shard.ws
+            if not ws or not ws.session_id or ws.socket.closed:
+                continue
+            shard._cancel_task()
+            await ws.close(code=4000)
+            if self.session_store.save(shard_id, self.shard_count, ws.session_id, ws.sequence, str(ws.gateway)):
+                self.logger.info(f'Saved session for shard {shard_id}')
+
+    # called by the signal handler and by discord.py on the way out, the side effects only happen once
+    async def close(self) -> None:
+        if self.closing:
+            return
+        self.closing = True
+        if self.session_store and not self.is_closed():
+            await self.save_sessions()
+        if self.warm_task:
+            self.warm_task.cancel()
+        await self.usage.stop()
+        if self.storage_watcher:
+            await self.storage_watcher.stop()
+        self.log_event_counts()
+        if self.loop_monitor:
+            self.logger.info(f'Event loop lag {self.loop_monitor.format_percentiles()}')
+            await self.loop_monitor.stop()
+        if self.metrics_server:
+            await self.metrics_server.close()
+        self.wiki_executor.shutdown(wait=False)
+        await super().close()
 
     # cleanup stuff
 
@@ -793,7 +1468,7 @@ class DeepBlueSky(discord.Client):
             _ = [task.cancel() for task in cleanup_tasks]
             await asyncio.gather(*cleanup_tasks)
         finally:
-            self.log_file.close()
+            self.log_pipeline.stop()
 
 
     # connect logic
@@ -802,9 +1477,25 @@ class DeepBlueSky(discord.Client):
     # because we subclass discord.Client
     async def on_ready(self):
         self.logger.info(f'Logged in as {self.user}')
+        if not timeline.has('ready'):
+            timeline.mark('ready')
+            timeline.report(self.logger)
         game = discord.Game(self.default_properties['command_prefix'] + 'help')
         await self.change_presence(status=discord.Status.online, activity=game)
 
+    # a resumed session never sees READY
+    async def on_shard_resumed(self, shard_id: int):
+        self.logger.info(f'Resumed shard {shard_id}')
+        if not timeline.has('ready'):
+            timeline.mark('ready')
+            timeline.report(self.logger)
+        game = discord.Game(self.default_properties['command_prefix'] + 'help')
+        await self.change_presence(status=discord.Status.online, activity=game, shard_id=shard_id)
+
+    async def login(self, token: str) -> None:
+        with timeline.measure('login'):
+            await super().login(token)
+
     async def run_bot(self, token=None):
         for sig in [signal.SIGINT, signal.SIGTERM, signal.SIGHUP, signal.SIGQUIT]:
             self.loop.add_signal_handler(sig, lambda sig = sig: asyncio.create_task(self.signal_handler(sig, self.loop)))
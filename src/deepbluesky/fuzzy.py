@@ -0,0 +1,131 @@
+# fuzzy.py
+# "did you mean" lookups for command names
+from __future__ import annotations
+
+import collections
+
+from typing import Callable, Dict, Iterable, List, Set, Tuple
+
+def trigrams(name: str) -> Set[str]:
+    padded = f'  {name} '
+    return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+# a bit per letter, shared by letters with the same low bits of their code point
+def letters(name: str) -> int:
+    mask = 0
+    for char in name:
+        mask |= 1 << (ord(char) & 63)
+    return mask
+
+# optimal string alignment distance to the query, so a swapped pair of letters counts once
+# bit-parallel, after Hyyrö, "A bit-vector algorithm for computing Levenshtein and Damerau edit distances"
+def distance_from(query: str) -> Callable[[str], int]:
+    length = len(query)
+    mask = (1 << length) - 1
+    last = 1 << (length - 1) if length else 0
+    peq: Dict[str, int] = {}
+    for i, char in enumerate(query):
+        peq[char] = peq.get(char, 0) | (1 << i)
+    def distance(name: str) -> int:
+        if not length:
+            return len(name)
+        vp = mask
+        vn = 0
+        d0 = 0
+        pm_prev = 0
+        score = length
+        for char in name:
+            pm = peq.get(char, 0)
+            tr = (((~d0) & pm) << 1) & pm_prev
+            d0 = ((((pm & vp) + vp) ^ vp) | pm | vn | tr) & mask
+            hp = (vn | ~(d0 | vp)) & mask
+            hn = d0 & vp
+            if hp & last:
+                score += 1
+            elif hn & last:
+                score -= 1
+            x = (hp << 1) | 1
+            vn = x & d0
+            vp = ((hn << 1) | ~(x | d0)) & mask
+            pm_prev = pm
+        return score
+    return distance
+
+class NameIndex:
+
+    # trigram postings, split up by name length since only names
+    # within max_distance of the query's length can match
+    # an edit changes at most 4 of a name's trigrams (3, or 4 for a swapped pair of letters)
+    def __init__(self, names: Iterable[str] = ()):
+        self.postings: Dict[Tuple[str, int], Set[str]] = collections.defaultdict(set)
+        # length -> name -> letters in it
+        self.by_length: Dict[int, Dict[str, int]] = collections.defaultdict(dict)
+        self.size = 0
+        for name in names:
+            self.add(name)
+
+    def add(self, name: str):
+        if name in self.by_length.get(len(name), ()):
+            return
+        for gram in trigrams(name):
+            self.postings[(gram, len(name))].add(name)
+        self.by_length[len(name)][name] = letters(name)
+        self.size += 1
+
+    def discard(self, name: str):
+        same_length = self.by_length.get(len(name))
+        if same_length is None or name not in same_length:
+            return
+        del same_length[name]
+        if not same_length:
+            del self.by_length[len(name)]
+        for gram in trigrams(name):
+            key = (gram, len(name))
+            names = self.postings[key]
+            names.discard(name)
+            if not names:
+                del self.postings[key]
+        self.size -= 1
+
+    def __len__(self) -> int:
+        return self.size
+
+    # (distance, name) pairs, closest first
+    # every name within max_distance is found, the trigrams only rule out the others
+    def search(self, query: str, max_distance: int = 2, limit: int = 3, scan_below: int = 16) -> List[Tuple[int, str]]:
+        # two edits turn most short names into any other short name
+        if len(query) <= 4:
+            max_distance = min(max_distance, 1)
+        lengths = [length for length in range(max(1, len(query) - max_distance), len(query) + max_distance + 1) if length in self.by_length]
+        query_grams = trigrams(query)
+        # a close name still has all but 4 * d of the query's trigrams
+        required = len(query_grams) - 4 * max_distance
+        candidates: Iterable[str]
+        # short queries, like 'bac' for 'abc', may share no trigrams at all with a close name
+        if required <= 0 or sum(len(self.by_length[length]) for length in lengths) <= scan_below:
+            # an edit adds at most one letter the query does not have, and removes at most one it has
+            query_letters = letters(query)
+            candidates = [name for length in lengths for name, name_letters in self.by_length[length].items()
+                if bin(query_letters & ~name_letters).count('1') <= max_distance and bin(name_letters & ~query_letters).count('1') <= max_distance]
+        else:
+            postings = []
+            for gram in query_grams:
+                sets = [self.postings[(gram, length)] for length in lengths if (gram, length) in self.postings]
+                postings.append((sum(len(names) for names in sets), sets))
+            postings.sort(key=lambda item: item[0])
+            # so it shares at least one of any 4 * d + 1 of them, and the most common ones
+            # (like the one for the first letter) are only looked up for names found in the others
+            shared: collections.Counter = collections.Counter()
+            for _, sets in postings[:4 * max_distance + 1]:
+                for names in sets:
+                    shared.update(names)
+            rest = [names for _, sets in postings[4 * max_distance + 1:] for names in sets]
+            candidates = [name for name, count in shared.items() if count + sum(name in names for names in rest) >= required]
+        distance_to = distance_from(query)
+        matches = []
+        for name in candidates:
+            distance = distance_to(name)
+            if distance <= max_distance:
+                matches.append((distance, name))
+        matches.sort()
+        return matches[:limit]
@@ -0,0 +1,31 @@
+# intents.py
+# which gateway events the bot subscribes to
+# every intent that is left out is traffic discord.py never has to parse
+from __future__ import annotations
+
+import discord
+
+# minimal: the guild list, enough for slash commands
+# wikitext: also messages, for prefix commands and wikitext, but no member list
+# full: also members and everything in the default intents
+INTENT_PROFILES = ('minimal', 'wikitext', 'full')
+
+def profile_intents(profile: str, dispatch: str) -> discord.Intents:
+    # pylint: disable=assigning-non-slot
+    if profile == 'minimal':
+        intents = discord.Intents.none()
+        intents.guilds = True
+        return intents
+    if profile == 'wikitext':
+        intents = discord.Intents.none()
+        intents.guilds = True
+        intents.guild_messages = True
+        intents.dm_messages = True
+    elif profile == 'full':
+        intents = discord.Intents.default()
+        intents.members = True
+    else:
+        raise ValueError(f'Invalid intent profile: {profile}')
+    # prefix commands and wikitext need to read every message
+    intents.message_content = dispatch != 'interactions'
+    return intents
@@ -0,0 +1,155 @@
+# interactions.py
+# application (slash) commands routed to the same Command.invoke as prefix commands
+
+# annotations are read by discord.py to build the command options
+# so this file does not use from __future__ import annotations
+
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import os
+
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+import discord
+from discord import app_commands
+
+from .command import Command, CommandFunction
+
+if TYPE_CHECKING:
+    from .deepbluesky import DeepBlueSky
+
+class InteractionChannel:
+
+    # stands in for trigger.channel, the first reply answers the interaction
+    # and the rest are followups
+    def __init__(self, interaction: discord.Interaction):
+        self.interaction = interaction
+        self.channel = interaction.channel
+        # held from checking whether the interaction has been answered until it is,
+        # so the deferral timer and a reply cannot both answer it
+        self.response_lock = asyncio.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.channel, name)
+
+    # reference and mention_author only apply to messages
+    async def send(self, content: Optional[str] = None, *, allowed_mentions: Optional[discord.AllowedMentions] = None, files: Optional[List[discord.File]] = None, **kwargs) -> Optional[discord.Message]:
+        message_kwargs: Dict[str, Any] = {}
+        if content is not None:
+            message_kwargs['content'] = content
+        if allowed_mentions is not None:
+            message_kwargs['allowed_mentions'] = allowed_mentions
+        if files:
+            message_kwargs['files'] = files
+        async with self.response_lock:
+            if not self.interaction.response.is_done():
+                await self.interaction.response.send_message(**message_kwargs)
+                return None
+        return await self.interaction.followup.send(wait=True, **message_kwargs)
+
+    async def defer(self):
+        async with self.response_lock:
+            if not self.interaction.response.is_done():
+                await self.interaction.response.defer(thinking=True)
+
+    # for commands that did not reply at all
+    async def acknowledge(self):
+        async with self.response_lock:
+            if not self.interaction.response.is_done():
+                await self.interaction.response.send_message('Done.', ephemeral=True)
+
+class InteractionTrigger:
+
+    # stands in for the trigger message of a prefix command
+    def __init__(self, interaction: discord.Interaction, content: str):
+        self.interaction = interaction
+        self.id = interaction.id
+        self.author = interaction.user
+        self.channel = InteractionChannel(interaction)
+        self.guild = interaction.guild
+        self.content = content
+        self.attachments: List[discord.Attachment] = []
+        self.reference = None
+
+def _description(command: Command) -> str:
+    description = command.get_help().strip() or command.name
+    return description if len(description) <= 100 else description[:99] + '…'
+
+class InteractionDispatcher:
+
+    # discord gives up on an interaction that gets no response within three seconds
+    defer_after: float = 2.0
+
+    def __init__(self, client: 'DeepBlueSky', logger: logging.Logger, hash_filename: str = 'app_commands.sha256'):
+        self.client = client
+        self.logger = logger
+        self.hash_filename = hash_filename
+        self.tree = app_commands.CommandTree(client)
+        for command in client.builtin_command_dict.values():
+            if isinstance(command, CommandFunction) and not command.owner_only and command.name != 'command':
+                self.tree.add_command(self._builtin(command))
+        self.tree.add_command(self._custom(client.builtin_command_dict['command']))
+
+    async def dispatch(self, interaction: discord.Interaction, command: Command, command_predicate: Optional[str]):
+        content = f'/{command.name} {command_predicate}' if command_predicate else f'/{command.name}'
+        trigger = InteractionTrigger(interaction, content)
+        space = self.client.get_message_space(trigger)
+        timer = asyncio.get_running_loop().call_later(self.defer_after, lambda: asyncio.ensure_future(trigger.channel.defer()))
+        try:
+            await command.invoke(trigger, space, command.name, command_predicate)
+        finally:
+            timer.cancel()
+        await trigger.channel.acknowledge()
+
+    def _builtin(self, command: Command) -> app_commands.Command:
+        @app_commands.describe(arguments='What would follow the command name in a message')
+        async def callback(interaction: discord.Interaction, arguments: Optional[str] = None):
+            await self.dispatch(interaction, command, arguments)
+        return app_commands.Command(name=command.name, description=_description(command), callback=callback)
+
+    # one command covers every custom command, whose names come from autocomplete
+    # so nothing has to be registered per space
+    def _custom(self, passthrough: Command) -> app_commands.Command:
+        @app_commands.describe(name='The command to call', arguments='What would follow the command name in a message')
+        async def callback(interaction: discord.Interaction, name: str, arguments: Optional[str] = None):
+            await self.dispatch(interaction, passthrough, f'{name} {arguments}' if arguments else name)
+        slash_command = app_commands.Command(name=passthrough.name, description='Call a command in this space', callback=callback)
+        @slash_command.autocomplete('name')
+        async def complete_name(interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+            return [app_commands.Choice(name=name, value=name) for name in await self.complete(interaction, current)]
+        return slash_command
+
+    async def complete(self, interaction: discord.Interaction, current: str, limit: int = 25) -> List[str]:
+        current = current.strip().lower()
+        trigger = InteractionTrigger(interaction, '')
+        space = self.client.get_message_space(trigger)
+        names = itertools.chain(self.client.builtin_command_dict, space.custom_command_dict)
+        matches = list(itertools.islice((name for name in names if name.startswith(current)), limit))
+        if len(matches) < limit and current:
+            matches += [name for name in await self.client.suggest_commands(space, current, limit=limit - len(matches)) if name not in matches]
+        return matches
+
+    # the command list only changes when the bot is updated
+    # so the bulk overwrite is skipped when it is the same as last time
+    # the commands are global, so with several shard processes only the one with shard 0 syncs them
+    async def sync(self) -> bool:
+        if self.client.shard_ids is not None and 0 not in self.client.shard_ids:
+            return False
+        payload = [command.to_dict(self.tree) for command in self.tree.get_commands()]
+        digest = hashlib.sha256(json.dumps([self.client.application_id, payload], sort_keys=True).encode()).hexdigest()
+        try:
+            with open(self.hash_filename, 'r', encoding='UTF-8') as hash_file:
+                if hash_file.read().strip() == digest:
+                    self.logger.info('Application commands are up to date')
+                    return False
+        except FileNotFoundError:
+            pass
+        synced = await self.tree.sync()
+        self.logger.info(f'Synced {len(synced)} application commands')
+        with open(f'{self.hash_filename}.tmp', 'w', encoding='UTF-8') as hash_file:
+            hash_file.write(digest)
+        os.replace(f'{self.hash_filename}.tmp', self.hash_filename)
+        return True
@@ -0,0 +1,207 @@
+# launcher.py
+# run a sharded bot across several processes
+# usage: python3 -m deepbluesky.launcher --processes 4 --shard-count 16
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from typing import List, Optional, Sequence
+
+class ShardProcess:
+
+    def __init__(self, launcher: Launcher, shard_ids: List[int], metrics_port: Optional[int] = None):
+        self.launcher = launcher
+        self.shard_ids = shard_ids
+        self.metrics_port = metrics_port
+        self.label = f'shard {shard_ids[0]}' if len(shard_ids) == 1 else f'shards {shard_ids[0]}-{shard_ids[-1]}'
+        self.process: Optional[subprocess.Popen] = None
+        self.reader: Optional[threading.Thread] = None
+        self.start_time: float = 0.0
+        self.restarts: int = 0
+        self.failures: int = 0
+        self.next_start: float = 0.0
+        self.last_line: str = ''
+        self.last_line_time: float = 0.0
+
+    def command(self) -> List[str]:
+        command = [
+            sys.executable, '-m', 'deepbluesky',
+            '--bot-name', self.launcher.bot_name,
+            '--shard-count', str(self.launcher.shard_count),
+            '--shard-ids', ','.join(str(shard_id) for shard_id in self.shard_ids),
+            '--log-stderr',
+            *self.launcher.bot_args,
+        ]
+        if self.metrics_port is not None:
+            command += ['--metrics-port', str(self.metrics_port)]
+        return command
+
+    def is_running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        logger = self.launcher.logger
+        try:
+            # pylint: disable=consider-using-with
+            self.process = subprocess.Popen(self.command(), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, encoding='UTF-8', errors='replace', bufsize=1)
+        except OSError:
+            logger.exception(f'[{self.label}] Unable to start process')
+            self.process = None
+            self.schedule_restart()
+            return
+        self.start_time = time.monotonic()
+        self.reader = threading.Thread(target=self._read_output, args=(self.process,), name=f'reader-{self.label}', daemon=True)
+        self.reader.start()
+        logger.info(f'[{self.label}] Started process {self.process.pid}')
+
+    def _read_output(self, process: subprocess.Popen):
+        for line in process.stdout:
+            self.last_line = line.rstrip()
+            self.last_line_time = time.monotonic()
+            self.launcher.logger.info(f'[{self.label}] {self.last_line}')
+        process.stdout.close()
+
+    def schedule_restart(self):
+        # a process that stayed up for a while was healthy
+        # so it starts over with the shortest backoff
+        if self.start_time and time.monotonic() - self.start_time >= self.launcher.stable_time:
+            self.failures = 0
+        delay = min(self.launcher.min_backoff * 2 ** self.failures, self.launcher.max_backoff)
+        self.failures += 1
+        self.next_start = time.monotonic() + delay
+        self.launcher.logger.warning(f'[{self.label}] Restarting in {delay:.0f} seconds')
+
+    # returns True if the process died since the last check
+    def check(self) -> bool:
+        if self.process is None:
+            if self.next_start and time.monotonic() >= self.next_start:
+                self.next_start = 0.0
+                self.restarts += 1
+                self.start()
+            return False
+        returncode = self.process.poll()
+        if returncode is None:
+            return False
+        self.launcher.logger.error(f'[{self.label}] Process {self.process.pid} exited with status {returncode}')
+        if self.reader:
+            self.reader.join(timeout=5)
+        self.process = None
+        self.schedule_restart()
+        return True
+
+    def stop(self):
+        if self.is_running():
+            self.process.send_signal(signal.SIGTERM)
+
+    def health(self) -> str:
+        if not self.is_running():
+            status = f'down, restart in {max(0.0, self.next_start - time.monotonic()):.0f}s' if self.next_start else 'down'
+        else:
+            status = f'pid {self.process.pid}, up {time.monotonic() - self.start_time:.0f}s'
+        quiet = f', quiet for {time.monotonic() - self.last_line_time:.0f}s' if self.last_line_time else ''
+        return f'{self.label}: {status}, {self.restarts} restarts{quiet}'
+
+class Launcher:
+
+    def __init__(self, bot_name: str, shard_count: int, processes: int, *, min_backoff: float = 5.0, max_backoff: float = 300.0, stable_time: float = 600.0, stagger: float = 5.0, health_interval: float = 60.0, metrics_port: Optional[int] = None, bot_args: Sequence[str] = ()):
+        if processes <= 0 or shard_count < processes:
+            raise ValueError(f'Cannot split {shard_count} shards across {processes} processes')
+        self.bot_name = bot_name
+        self.shard_count = shard_count
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.stable_time = stable_time
+        self.stagger = stagger
+        self.health_interval = health_interval
+        # passed on to every shard process
+        self.bot_args = list(bot_args)
+        self.stopping = False
+
+        self.logger = logging.getLogger('deepbluesky.launcher')
+        self.logger.setLevel(logging.INFO)
+        if not self.logger.handlers:
+            handler = logging.StreamHandler(stream=sys.stdout)
+            formatter = logging.Formatter(fmt='[{asctime}] {message}', style='{')
+            formatter.converter = time.gmtime # type: ignore
+            handler.setFormatter(formatter)
+            self.logger.addHandler(handler)
+
+        # contiguous blocks, as evenly sized as possible
+        per_process, extra = divmod(shard_count, processes)
+        self.shards: List[ShardProcess] = []
+        first = 0
+        for index in range(processes):
+            size = per_process + (1 if index < extra else 0)
+            # each process serves its metrics on its own port
+            port = metrics_port + index if metrics_port is not None else None
+            self.shards.append(ShardProcess(self, list(range(first, first + size)), metrics_port=port))
+            first += size
+
+    def stop(self, caught_signal: int, frame):
+        self.logger.info(f'Received signal {caught_signal}, stopping all shards')
+        self.stopping = True
+        for shard in self.shards:
+            shard.stop()
+
+    def run(self) -> int:
+        for sig in [signal.SIGINT, signal.SIGTERM, signal.SIGHUP, signal.SIGQUIT]:
+            signal.signal(sig, self.stop)
+        self.logger.info(f'Launching {self.shard_count} shards in {len(self.shards)} processes')
+        for shard in self.shards:
+            if self.stopping:
+                break
+            shard.start()
+            # discord only allows one IDENTIFY every five seconds
+            time.sleep(self.stagger * len(shard.shard_ids))
+        last_health = time.monotonic()
+        while not self.stopping:
+            for shard in self.shards:
+                shard.check()
+            if time.monotonic() - last_health >= self.health_interval:
+                last_health = time.monotonic()
+                self.logger.info('Health: %s', '; '.join(shard.health() for shard in self.shards))
+            time.sleep(1.0)
+        deadline = time.monotonic() + 30.0
+        for shard in self.shards:
+            if shard.process is None:
+                continue
+            try:
+                shard.process.wait(timeout=max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                self.logger.error(f'[{shard.label}] Did not exit, killing process {shard.process.pid}')
+                shard.process.kill()
+                shard.process.wait()
+            if shard.reader:
+                shard.reader.join(timeout=5)
+        self.logger.info('All shards stopped')
+        return 0
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='deepbluesky.launcher', description='Run a Deep Blue Sky bot as several shard processes')
+    parser.add_argument('--bot-name', default='deep-blue-sky', help='name of the bot, used for its storage directory')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='number of shard processes (default: number of CPUs)')
+    parser.add_argument('--shard-count', type=int, help='total number of shards (default: one per process)')
+    parser.add_argument('--min-backoff', type=float, default=5.0, help='seconds to wait before the first restart of a shard process')
+    parser.add_argument('--max-backoff', type=float, default=300.0, help='upper limit on the restart delay')
+    parser.add_argument('--health-interval', type=float, default=60.0, help='seconds between health reports')
+    parser.add_argument('--metrics-port', type=int, help='serve metrics from the first process on this port, and the others on the ports after it')
+    parser.add_argument('--no-chunk-at-startup', action='store_true', help='passed on to each shard process: do not download the member list of every guild at startup')
+    parser.add_argument('--chunk-active-guilds', action='store_true', help='passed on to each shard process: download the member list of a guild once someone uses the bot there')
+    args = parser.parse_args(argv)
+    bot_args = [flag for flag, enabled in (('--no-chunk-at-startup', args.no_chunk_at_startup), ('--chunk-active-guilds', args.chunk_active_guilds)) if enabled]
+    shard_count = args.shard_count if args.shard_count else args.processes
+    try:
+        launcher = Launcher(bot_name=args.bot_name, shard_count=shard_count, processes=args.processes, min_backoff=args.min_backoff, max_backoff=args.max_backoff, health_interval=args.health_interval, metrics_port=args.metrics_port, bot_args=bot_args)
+    except ValueError as ex:
+        parser.error(str(ex))
+    return launcher.run()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+# logs.py
+# log records are handed to a queue on the event loop
+# and written to disk by a background thread
+from __future__ import annotations
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+from typing import Any, Dict, List, Optional, Tuple
+
+# extra fields attached by the bot, e.g. in Command.invoke
+STRUCTURED_FIELDS = ('space_id', 'command', 'latency', 'author')
+
+class JSONFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+class RepeatFilter(logging.Filter):
+
+    # lets through at most `limit` warnings or errors from the same line of code per window
+    # the first one let through afterwards says how many were dropped
+    def __init__(self, window: float = 60.0, limit: int = 5):
+        super().__init__()
+        self.window = window
+        self.limit = limit
+        # call site -> [window start, records seen, records suppressed]
+        self.seen: Dict[Tuple[str, int, int], List[float]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno, record.levelno)
+        now = record.created
+        state = self.seen.get(key)
+        if state is None or now - state[0] >= self.window:
+            suppressed = int(state[2]) if state else 0
+            self.seen[key] = [now, 1, 0]
+            if suppressed:
+                record.msg = f'{record.getMessage()} ({suppressed} similar {"message" if suppressed == 1 else "messages"} suppressed)'
+                record.args = None
+            return True
+        state[1] += 1
+        if state[1] > self.limit:
+            state[2] += 1
+            return False
+        return True
+
+_EXCEPTION_FORMATTER = logging.Formatter()
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+
+    # the stock prepare() formats the traceback into the message and drops it,
+    # which leaves JSONFormatter nothing to put in the exception field
+    # the traceback is still formatted here, while the frames are alive, but kept in exc_text
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _EXCEPTION_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class LogPipeline:
+
+    def __init__(self, handlers: List[logging.Handler]):
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.queue_handler = RecordQueueHandler(self.queue)
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.running = False
+
+    def start(self):
+        if not self.running:
+            self.listener.start()
+            self.running = True
+
+    # flushes everything still in the queue
+    def stop(self):
+        if self.running:
+            self.running = False
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+
+def setup_logging(logger: logging.Logger, *, filename: str = 'bot_output.log', max_bytes: int = 16 * 1024 * 1024, backup_count: int = 5, rotate_when: Optional[str] = None, json_format: bool = False, repeat_window: float = 60.0, repeat_limit: int = 5, log_stderr: bool = False) -> LogPipeline:
+    if json_format:
+        formatter: logging.Formatter = JSONFormatter()
+    else:
+        formatter = logging.Formatter(fmt='[{asctime}] {levelname}: {message}', style='{')
+        formatter.converter = time.gmtime # type: ignore
+    file_handler: logging.Handler
+    if rotate_when:
+        file_handler = logging.handlers.TimedRotatingFileHandler(filename, when=rotate_when, backupCount=backup_count, encoding='UTF-8', utc=True)
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='UTF-8')
+    handlers: List[logging.Handler] = [file_handler]
+    if log_stderr:
+        handlers.append(logging.StreamHandler(stream=sys.stderr))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        handler.addFilter(RepeatFilter(window=repeat_window, limit=repeat_limit))
+    pipeline = LogPipeline(handlers)
+    logger.addHandler(pipeline.queue_handler)
+    pipeline.start()
+    atexit.register(pipeline.stop)
+    return pipeline
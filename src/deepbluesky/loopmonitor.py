@@ -0,0 +1,91 @@
+# loopmonitor.py
+# watch the event loop for callbacks that block it
+from __future__ import annotations
+
+import asyncio
+import collections
+import logging
+import threading
+import time
+
+from typing import Deque, Dict, Optional
+
+from .metrics import registry
+from .profiler import thread_stack
+
+loop_lag = registry.histogram('deepbluesky_loop_lag_seconds', 'Event loop scheduling lag', buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+loop_stalls = registry.counter('deepbluesky_loop_stalls_total', 'Times the event loop was blocked for longer than the threshold')
+
+class LoopMonitor:
+
+    def __init__(self, logger: logging.Logger, threshold: float = 0.5, interval: float = 0.1, history: int = 3000):
+        self.logger = logger
+        self.threshold = threshold
+        self.interval = interval
+        self.lags: Deque[float] = collections.deque(maxlen=history)
+        # what the loop was last asked to do, set by the bot
+        self.activity: str = 'idle'
+        self.last_tick: float = time.monotonic()
+        self.loop_thread_id: Optional[int] = None
+        self._reported_tick: float = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._task:
+            return
+        self.loop_thread_id = threading.get_ident()
+        self.last_tick = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._tick())
+        self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog:
+            self._watchdog.join()
+            self._watchdog = None
+
+    async def _tick(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.last_tick = now
+            lag = max(0.0, now - expected)
+            self.lags.append(lag)
+            loop_lag.observe(lag)
+            if lag >= self.threshold:
+                self.logger.warning(f'Event loop lagged {1000 * lag:.0f} ms, last activity: {self.activity}, lag {self.format_percentiles()}')
+
+    # runs in its own thread so it can look at the loop while it is stuck
+    def _watch(self):
+        while not self._stop.wait(self.threshold / 2):
+            tick = self.last_tick
+            stalled = time.monotonic() - tick - self.interval
+            if stalled < self.threshold or tick == self._reported_tick:
+                continue
+            self._reported_tick = tick
+            loop_stalls.inc()
+            stack = '\n    '.join(thread_stack(self.loop_thread_id))
+            self.logger.warning(f'Event loop blocked for {1000 * stalled:.0f} ms so far, last activity: {self.activity}\n  loop thread stack:\n    {stack}')
+
+    def percentiles(self) -> Dict[str, float]:
+        if not self.lags:
+            return {}
+        lags = sorted(self.lags)
+        def pick(fraction: float) -> float:
+            return lags[min(len(lags) - 1, int(fraction * len(lags)))]
+        return {'p50': pick(0.5), 'p90': pick(0.9), 'p99': pick(0.99), 'max': lags[-1]}
+
+    def format_percentiles(self) -> str:
+        return ', '.join(f'{name}: {1000 * value:.1f} ms' for name, value in self.percentiles().items())
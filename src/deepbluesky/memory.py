@@ -0,0 +1,144 @@
+# memory.py
+# where the memory goes, by subsystem, and what changed between two points in time
+from __future__ import annotations
+
+import gc
+import itertools
+import os
+import random
+import sys
+import tracemalloc
+
+from typing import TYPE_CHECKING, Any, Iterable, List, Optional, Set, Tuple
+
+from .command import CommandAlias, CommandSimple, CommandTemplate
+
+if TYPE_CHECKING:
+    from .deepbluesky import DeepBlueSky
+
+# objects shared with the rest of the bot, such as the client, are not followed
+_OPAQUE = (type, type(sys), type(len))
+
+def deep_sizeof(obj: Any, seen: Optional[Set[int]] = None, shallow: Iterable[Any] = ()) -> int:
+    if seen is None:
+        seen = {id(item) for item in shallow}
+    stack = [obj]
+    size = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, _OPAQUE):
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif isinstance(item, (str, bytes, int, float)):
+            continue
+        else:
+            if hasattr(item, '__dict__'):
+                stack.append(item.__dict__)
+            for cls in type(item).__mro__:
+                for slot in getattr(cls, '__slots__', ()):
+                    value = getattr(item, slot, None)
+                    if value is not None:
+                        stack.append(value)
+    return size
+
+# measuring every member of a big guild takes too long, so measure some and scale up
+def sampled_sizeof(items: List[Any], shallow: Iterable[Any] = (), sample_size: int = 200) -> int:
+    if not items:
+        return 0
+    if len(items) <= sample_size:
+        return deep_sizeof(items, shallow=shallow)
+    sample = random.sample(items, sample_size)
+    return deep_sizeof(sample, shallow=shallow) * len(items) // sample_size
+
+def _format_bytes(size: int) -> str:
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} GiB'
+
+def resident_bytes() -> Optional[int]:
+    try:
+        with open('/proc/self/statm', 'r', encoding='UTF-8') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, ValueError):
+        return None
+
+def memory_report(client: DeepBlueSky, top_spaces: int = 5) -> str:
+    spaces = list(client.spaces.values())
+    # everything reachable from these belongs to someone else
+    # pylint: disable=protected-access
+    shallow = [client, client.logger, client._connection, client.http, *client.builtin_command_dict.values(), *spaces]
+    commands = [command for space in spaces for command in list(space.custom_command_dict.values())]
+    aliased = [command for command in commands if command.aliases]
+    alias_count = sum(isinstance(command, CommandAlias) for command in commands)
+    rows: List[Tuple[str, str, int]] = []
+    rows.append(('spaces', f'{len(spaces)}', sum(deep_sizeof(space.get_all_properties(), shallow=shallow) + sys.getsizeof(space) + sys.getsizeof(space.__dict__) for space in spaces)))
+    rows.append(('custom commands', f'{len(commands)}, {alias_count} aliases', sampled_sizeof(commands, shallow=shallow)))
+    rows.append(('alias lists', f'{len(aliased)}', sum(sys.getsizeof(command.aliases) for command in aliased)))
+    rows.append(('name indexes', f'{sum(space._name_index is not None for space in spaces)}', sum(deep_sizeof(space._name_index) for space in spaces if space._name_index is not None)))
+    caches = [('command value cache', CommandSimple.value_cache), ('compiled template cache', CommandTemplate.compiled_cache),
+        ('member query cache', client.member_query_cache), ('wiki reply cache', client.wiki_replies)]
+    for name, cache in caches:
+        # the keys are commands and messages, which are counted elsewhere
+        rows.append((name, f'{len(cache)}/{cache.maxsize}', sum(deep_sizeof(value, shallow=shallow) for value in list(cache._data.values()))))
+    members = [member for guild in client.guilds for member in guild.members]
+    rows.append(('member cache', f'{len(members)} in {len(client.guilds)} guilds', sampled_sizeof(members, shallow=shallow + list(client.guilds))))
+    rows.append(('user cache', f'{len(client.users)}', sampled_sizeof(list(client.users), shallow=shallow)))
+    messages = list(client.cached_messages)
+    rows.append(('message cache', f'{len(messages)}', sampled_sizeof(messages, shallow=shallow + list(client.guilds))))
+    rows.append(('usage counts', f'{sum(len(space_usage) for space_usage in client.usage.usage.values())}', deep_sizeof(client.usage.usage)))
+    lines = ['```', f'{"subsystem":<24} {"objects":<28} {"approx size":>12}']
+    lines += [f'{name:<24} {count:<28} {_format_bytes(size):>12}' for name, count, size in rows]
+    lines.append('')
+    largest = sorted(spaces, key=lambda space: len(space.custom_command_dict), reverse=True)[:top_spaces]
+    lines += [f'{space.space_id:<24} {len(space.custom_command_dict)} commands' for space in largest]
+    lines.append('')
+    rss = resident_bytes()
+    if rss is not None:
+        lines.append(f'resident set size: {_format_bytes(rss)}')
+    lines.append(f'gc tracked objects: {len(gc.get_objects())}')
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        lines.append(f'tracemalloc: {_format_bytes(current)} traced, {_format_bytes(peak)} peak')
+    lines.append('```')
+    return '\n'.join(lines)
+
+class TracemallocSession:
+
+    # tracemalloc slows down every allocation, so it only runs between start and stop
+    def __init__(self):
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+
+    def start(self, frames: int = 1):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self.baseline = tracemalloc.take_snapshot()
+
+    # the biggest changes since the last start or diff, which becomes the new baseline
+    def diff(self, limit: int = 100) -> str:
+        if self.baseline is None or not tracemalloc.is_tracing():
+            raise RuntimeError('tracemalloc is not running')
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        key_type = 'traceback' if tracemalloc.get_traceback_limit() > 1 else 'lineno'
+        stats = snapshot.compare_to(self.baseline, key_type)
+        self.baseline = snapshot
+        lines = [f'{sum(stat.size_diff for stat in stats):+d} bytes in {sum(stat.count_diff for stat in stats):+d} blocks', '']
+        for stat in itertools.islice(stats, limit):
+            lines.append(str(stat))
+            if key_type == 'traceback':
+                lines += [f'    {line}' for line in stat.traceback.format()]
+        return '\n'.join(lines) + '\n'
+
+    def stop(self):
+        self.baseline = None
+        tracemalloc.stop()
+
+    def is_running(self) -> bool:
+        return self.baseline is not None and tracemalloc.is_tracing()
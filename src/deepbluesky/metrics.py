@@ -0,0 +1,200 @@
+# metrics.py
+# in-process metrics, served in the prometheus text format
+from __future__ import annotations
+
+import asyncio
+import bisect
+import logging
+import math
+import time
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+
+    metric_type = 'untyped'
+
+    def __init__(self, name: str, helpstring: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.helpstring = helpstring
+        self.labelnames = labelnames
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.helpstring}', f'# TYPE {self.name} {self.metric_type}', *self._render0()]
+
+    def _render0(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(Metric):
+
+    metric_type = 'counter'
+
+    def __init__(self, name: str, helpstring: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, helpstring, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    # this is on the hot path, keep it to a single dict update
+    def inc(self, *labels: str, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels: str) -> float:
+        return self.values.get(labels, 0)
+
+    def _render0(self) -> List[str]:
+        return [f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}' for labels, value in list(self.values.items())]
+
+class Gauge(Metric):
+
+    metric_type = 'gauge'
+
+    # gauges are computed when scraped
+    def __init__(self, name: str, helpstring: str, callback: Callable[[], float]):
+        super().__init__(name, helpstring)
+        self.callback = callback
+
+    def _render0(self) -> List[str]:
+        return [f'{self.name} {_format_value(self.callback())}']
+
+# seconds, tuned for discord round trips and wiki lookups
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram(Metric):
+
+    metric_type = 'histogram'
+
+    def __init__(self, name: str, helpstring: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, helpstring, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count in each bucket plus overflow, sum]
+        self.values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [0] * (len(self.buckets) + 2)
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def count(self, *labels: str) -> int:
+        entry = self.values.get(labels)
+        return sum(entry[:-1]) if entry else 0
+
+    def _render0(self) -> List[str]:
+        lines = []
+        for labels, entry in list(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), entry[:-1]):
+                cumulative += bucket_count
+                bound_label = 'le="' + _format_value(bound) + '"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, extra=bound_label)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(entry[-1])}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            if type(existing) is not type(metric):
+                raise ValueError(f'Metric already registered with another type: {metric.name}')
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, helpstring: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, helpstring, labelnames))
+
+    def histogram(self, name: str, helpstring: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, helpstring, labelnames, buckets))
+
+    # re-registering a gauge replaces its callback
+    def gauge(self, name: str, helpstring: str, callback: Callable[[], float]) -> Gauge:
+        gauge = self._register(Gauge(name, helpstring, callback))
+        gauge.callback = callback
+        return gauge
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            try:
+                lines += metric.render()
+            # gauges run arbitrary callbacks, and one that fails must not take the whole scrape down with it
+            except Exception: # pylint: disable=broad-except
+                logging.getLogger('discord').exception(f'Unable to render metric: {metric.name}')
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+# shared by the modules that record into them
+command_calls = registry.counter('deepbluesky_commands_total', 'Command invocations', ('command', 'outcome'))
+command_latency = registry.histogram('deepbluesky_command_seconds', 'Command invocation latency', ('command',))
+space_messages = registry.counter('deepbluesky_space_messages_total', 'Messages handled per space', ('space',))
+gateway_events = registry.counter('deepbluesky_gateway_events_total', 'Gateway events received', ('event',))
+filtered_messages = registry.counter('deepbluesky_filtered_messages_total', 'Messages passed or rejected before space lookup', ('outcome',))
+wiki_lookups = registry.counter('deepbluesky_wiki_lookups_total', 'Wiki backend lookups', ('backend', 'outcome'))
+wiki_latency = registry.histogram('deepbluesky_wiki_lookup_seconds', 'Wiki backend latency', ('backend',))
+send_latency = registry.histogram('deepbluesky_send_seconds', 'Latency of sending a message to a channel')
+storage_latency = registry.histogram('deepbluesky_storage_write_seconds', 'Latency of storage writes', ('kind',))
+
+class MetricsServer:
+
+    def __init__(self, metrics: MetricsRegistry, host: str = '127.0.0.1', port: int = 9464):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+
+    async def close(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5.0)
+            while True:
+                header = await asyncio.wait_for(reader.readline(), timeout=5.0)
+                if header in (b'\r\n', b'\n', b''):
+                    break
+            parts = request_line.decode('latin-1').split()
+            if len(parts) < 2 or parts[0] not in ('GET', 'HEAD'):
+                status, body = '405 Method Not Allowed', ''
+            elif parts[1].split('?', maxsplit=1)[0] in ('/', '/metrics'):
+                start = time.perf_counter()
+                body = self.metrics.render()
+                body += f'# rendered in {time.perf_counter() - start:.6f} seconds\n'
+                status = '200 OK'
+            else:
+                status, body = '404 Not Found', ''
+            payload = body.encode('UTF-8') if parts and parts[0] != 'HEAD' else b''
+            writer.write((f'HTTP/1.1 {status}\r\n'
+                f'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                f'Content-Length: {len(body.encode("UTF-8"))}\r\n'
+                f'Connection: close\r\n\r\n').encode('latin-1') + payload)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
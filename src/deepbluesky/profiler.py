@@ -0,0 +1,99 @@
+# profiler.py
+# profiling the live event loop
+from __future__ import annotations
+
+import asyncio
+import collections
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+
+from types import FrameType
+from typing import Dict, List, Optional, Tuple
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})'
+
+# outermost frame first
+def frame_stack(frame: Optional[FrameType], limit: int = 128) -> List[str]:
+    stack = []
+    while frame is not None and len(stack) < limit:
+        stack.append(_frame_name(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+def thread_stack(thread_id: int) -> List[str]:
+    # pylint: disable=protected-access
+    return frame_stack(sys._current_frames().get(thread_id))
+
+class SamplingProfiler:
+
+    # samples the stack of another thread, normally the one running the event loop
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Dict[Tuple[str, ...], int] = collections.Counter()
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            # pylint: disable=protected-access
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples[tuple(frame_stack(frame))] += 1
+            self.sample_count += 1
+            del frame
+
+    # the format used by flamegraph.pl and speedscope
+    def collapsed(self) -> str:
+        lines = [';'.join(stack) + f' {count}' for stack, count in sorted(self.samples.items(), key=lambda item: -item[1])]
+        return '\n'.join(lines) + '\n'
+
+async def sample_event_loop(duration: float, interval: float = 0.005) -> SamplingProfiler:
+    profiler = SamplingProfiler(threading.get_ident(), interval=interval)
+    profiler.start()
+    try:
+        await asyncio.sleep(duration)
+    finally:
+        profiler.stop()
+    return profiler
+
+# cProfile only sees the thread it was enabled on
+# this runs on the event loop thread, so it catches every task and callback
+async def cprofile_event_loop(duration: float) -> Tuple[bytes, str]:
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        await asyncio.sleep(duration)
+    finally:
+        profile.disable()
+    profile.create_stats()
+    stats_text = io.StringIO()
+    stats = pstats.Stats(profile, stream=stats_text)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(100)
+    # the same bytes pstats.Stats.dump_stats would write
+    return (marshal.dumps(profile.stats), stats_text.getvalue())
+
+def profile_filename(kind: str, extension: str) -> str:
+    return time.strftime(f'profile-{kind}-%Y%m%d-%H%M%S.{extension}', time.gmtime())
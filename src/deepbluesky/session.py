@@ -0,0 +1,64 @@
+# session.py
+# gateway sessions are saved on shutdown
+# so the next process can RESUME instead of IDENTIFY
+from __future__ import annotations
+
+import json
+import logging
+import os
+import time
+
+from typing import Any, Dict, Optional
+
+class SessionStore:
+
+    # discord does not say how long a session stays resumable
+    # but it is a matter of minutes, after which RESUME fails and costs a round trip
+    def __init__(self, logger: logging.Logger, dirname: str = 'sessions', max_age: float = 120.0):
+        self.logger = logger
+        self.dirname = dirname
+        self.max_age = max_age
+
+    def _filename(self, shard_id: int) -> str:
+        return f'{self.dirname}/shard_{shard_id}.json'
+
+    def save(self, shard_id: int, shard_count: int, session_id: str, sequence: Optional[int], resume_gateway_url: str) -> bool:
+        session = {
+            'shard_id': shard_id,
+            'shard_count': shard_count,
+            'session_id': session_id,
+            'sequence': sequence,
+            'resume_gateway_url': resume_gateway_url,
+            'time': time.time(),
+        }
+        filename = self._filename(shard_id)
+        try:
+            os.makedirs(self.dirname, mode=0o700, exist_ok=True)
+            with open(f'{filename}.tmp', 'w', encoding='UTF-8') as json_file:
+                json.dump(session, json_file)
+            os.replace(f'{filename}.tmp', filename)
+        except IOError:
+            self.logger.exception(f'Unable to save session for shard {shard_id}')
+            return False
+        return True
+
+    # a saved session is only ever used once
+    def load(self, shard_id: int, shard_count: int) -> Optional[Dict[str, Any]]:
+        filename = self._filename(shard_id)
+        try:
+            with open(filename, 'r', encoding='UTF-8') as json_file:
+                session = json.load(json_file)
+            os.remove(filename)
+        except FileNotFoundError:
+            return None
+        except (IOError, ValueError):
+            self.logger.exception(f'Unable to load session for shard {shard_id}')
+            return None
+        age = time.time() - session['time']
+        if session['shard_count'] != shard_count:
+            self.logger.info(f'Not resuming shard {shard_id}, shard count changed from {session["shard_count"]} to {shard_count}')
+            return None
+        if age > self.max_age:
+            self.logger.info(f'Not resuming shard {shard_id}, session is {age:.0f} seconds old')
+            return None
+        return session
@@ -1,20 +1,67 @@
 # space.py
 from __future__ import annotations
 import abc
-import json
+import asyncio
 import os
 import re
 import time
 
 from typing import TYPE_CHECKING, Any, Optional
-from typing import Dict, FrozenSet, List, OrderedDict
+from typing import Dict, FrozenSet, Iterable, List, OrderedDict
 
 import discord
-from .command import Command, CommandAlias, CommandSimple
+from .backends import dump_json, load_json
+from .command import Command, CommandAlias, CommandSimple, CommandTemplate
+from .fuzzy import NameIndex
+from .metrics import storage_latency
 
 if TYPE_CHECKING:
     from .deepbluesky import DeepBlueSky
 
+def _remove_if_present(path: str, quiet: bool = False):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except IOError:
+        if not quiet:
+            raise
+
+# the helpers of Space.save_commands fill in the lists and dicts they are given as they go,
+# so a failure part of the way through can still be rolled back
+
+# hard links, so the old file stays as it was while the new one replaces it
+def _back_up(paths: Iterable[str], backups: Dict[str, bool]):
+    for path in paths:
+        _remove_if_present(f'{path}.bak')
+        try:
+            os.link(path, f'{path}.bak')
+            backups[path] = True
+        except FileNotFoundError:
+            backups[path] = False
+
+def _replace(staged: Iterable[str], removed: Iterable[str], applied: List[str]):
+    for path in staged:
+        os.replace(f'{path}.tmp', path)
+        applied.append(path)
+    for path in removed:
+        applied.append(path)
+        _remove_if_present(path)
+
+def _roll_back(applied: List[str], backups: Dict[str, bool]):
+    for path in reversed(applied):
+        if backups[path]:
+            os.replace(f'{path}.bak', path)
+        else:
+            _remove_if_present(path)
+
+def _clean_up(staged: Iterable[str], backups: Dict[str, bool]):
+    for path in staged:
+        _remove_if_present(f'{path}.tmp', quiet=True)
+    for path, backed_up in backups.items():
+        if backed_up:
+            _remove_if_present(f'{path}.bak', quiet=True)
+
 class Space(abc.ABC):
 
     # pylint: disable=function-redefined
@@ -29,6 +76,9 @@ class Space(abc.ABC):
         self.command_prefix: Optional[str] = None
         self.space_type: str = space_type
         self.space_id: str = f'{space_type}_{base_id}'
+        # built on the first unknown command, then kept up to date
+        self._name_index: Optional[NameIndex] = None
+        self._lock: Optional[asyncio.Lock] = None
 
     def __str__(self) -> str:
         return self.space_id
@@ -43,6 +93,58 @@ class Space(abc.ABC):
     def __hash__(self) -> int:
         return hash((type(self), self.space_id))
 
+    def add_command(self, command: Command):
+        if self._name_index is not None and command.name not in self.custom_command_dict:
+            self._name_index.add(command.name)
+        self.custom_command_dict[command.name] = command
+
+    def delete_command(self, name: str):
+        command = self.custom_command_dict.pop(name)
+        if isinstance(command, CommandSimple):
+            CommandSimple.value_cache.pop(command)
+            CommandTemplate.compiled_cache.pop(command)
+        self.client.usage.forget(self.space_id, name)
+        if self._name_index is not None:
+            self._name_index.discard(name)
+
+    # building the index for a big space takes a while, so it happens off the event loop
+    # and catches up afterwards with commands added or removed in the meantime
+    async def get_name_index(self) -> NameIndex:
+        if self._name_index is None:
+            names = set(self.custom_command_dict)
+            index = await asyncio.get_running_loop().run_in_executor(None, NameIndex, names)
+            if self._name_index is None:
+                current = self.custom_command_dict.keys()
+                for name in names - current:
+                    index.discard(name)
+                for name in current - names:
+                    index.add(name)
+                self._name_index = index
+        return self._name_index
+
+    # before loading the commands again from storage
+    def clear_commands(self):
+        for command in self.custom_command_dict.values():
+            # aliases of built-in commands are listed on the built-in command
+            if isinstance(command, CommandAlias):
+                command.follow().remove_alias(command)
+            elif isinstance(command, CommandSimple):
+                CommandSimple.value_cache.pop(command)
+                CommandTemplate.compiled_cache.pop(command)
+        self.custom_command_dict = OrderedDict([])
+        self._name_index = None
+
+    # held from checking a bulk change through to saving it
+    @property
+    def lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    # where a command is saved, and where its value is read back from
+    def command_path(self, command_name: str) -> str:
+        return f'storage/{self.space_id}/commands/{command_name}.json'
+
     def get_all_properties(self) -> Dict[str, Any]:
         return {attr: getattr(self, attr) for attr in list(self.client.default_properties.keys()) + ['crtime', 'mtime']}
 
@@ -50,32 +152,80 @@ class Space(abc.ABC):
         if update_mtime:
             self.mtime = int(time.time())
         space_properties = self.get_all_properties()
+        self.client.invalidate_message_filter()
         dirname = f'storage/{self.space_id}'
+        start = time.perf_counter()
         try:
             os.makedirs(dirname, mode=0o755, exist_ok=True)
             with open(f'{dirname}/space.json', 'w', encoding='UTF-8') as json_file:
-                json.dump(space_properties, json_file)
+                dump_json(space_properties, json_file)
+            self.client.storage_written(f'{dirname}/space.json')
         except IOError:
             self.client.logger.exception(f'Unable to save space: {self.space_id}')
             return False
+        finally:
+            storage_latency.observe(time.perf_counter() - start, 'space')
         return True
 
     def save_command(self, command_name: str, update_mtime: bool = True) -> bool:
         dirname=f'storage/{self.space_id}/commands'
-        command_json_fname = f'{dirname}/{command_name}.json'
+        command_json_fname = self.command_path(command_name)
+        start = time.perf_counter()
         try:
             os.makedirs(dirname, mode=0o755, exist_ok=True)
             if command_name in self.custom_command_dict:
                 command = self.custom_command_dict[command_name]
                 command.modification_time = int(time.time())
                 with open(command_json_fname, 'w', encoding='UTF-8') as json_file:
-                    json.dump(command.get_dict(), json_file)
+                    dump_json(command.get_dict(), json_file)
+                if isinstance(command, CommandSimple):
+                    command.unload_value()
             elif os.path.isfile(command_json_fname):
                 os.remove(command_json_fname)
+            self.client.storage_written(command_json_fname)
             return True
         except IOError:
             self.client.logger.exception(f'Unable to save command in space: {self.space_id}')
             return False
+        finally:
+            storage_latency.observe(time.perf_counter() - start, 'command')
+
+    # every file is written before any of them replaces the old one,
+    # and the old ones are kept until all of them have been replaced
+    # returns False if storage was left as it was, and raises IOError if it could not be
+    def save_commands(self, command_dicts: Dict[str, Dict[str, Any]], removed: Iterable[str]) -> bool:
+        dirname=f'storage/{self.space_id}/commands'
+        staged: List[str] = []
+        removed_paths = [self.command_path(command_name) for command_name in removed]
+        # path -> whether there was a file to restore
+        backups: Dict[str, bool] = {}
+        applied: List[str] = []
+        start = time.perf_counter()
+        try:
+            os.makedirs(dirname, mode=0o755, exist_ok=True)
+            self._stage_commands(command_dicts, staged)
+            _back_up(staged + removed_paths, backups)
+            _replace(staged, removed_paths, applied)
+        except IOError:
+            self.client.logger.exception(f'Unable to save commands in space: {self.space_id}')
+            # raises if storage cannot be put back either
+            _roll_back(applied, backups)
+            return False
+        finally:
+            _clean_up(staged, backups)
+            storage_latency.observe(time.perf_counter() - start, 'batch')
+        return True
+
+    # staged collects the paths with a .tmp file written next to them
+    def _stage_commands(self, command_dicts: Dict[str, Dict[str, Any]], staged: List[str]):
+        for command_name, command_dict in command_dicts.items():
+            with open(f'{self.command_path(command_name)}.tmp', 'w', encoding='UTF-8') as json_file:
+                staged.append(self.command_path(command_name))
+                dump_json(command_dict, json_file)
+
+    def load_command_value(self, command_name: str) -> str:
+        with open(self.command_path(command_name), 'r', encoding='UTF-8') as json_file:
+            return load_json(json_file)['value']
 
     def load_properties(self, property_dict: Dict[str, Any]):
         for attr in self.client.default_properties.keys():
@@ -84,10 +234,12 @@ class Space(abc.ABC):
         self.space_id = f'{self.space_type}_{self.base_id}'
         for attr in ['crtime', 'mtime']:
             setattr(self, attr, property_dict.get(attr, int(time.time())))
+        self.client.invalidate_message_filter()
 
-    def load_command(self, command_dict: Dict[str, Any]) -> bool:
+    # resident: keep the value in memory, as it cannot be read back from command_path
+    def load_command(self, command_dict: Dict[str, Any], resident: bool = False) -> bool:
         # python 3.10: use patterns
-        if command_dict['type'] != 'simple' and command_dict['type'] != 'alias':
+        if command_dict['type'] not in ('simple', 'template', 'alias'):
             msg = f'Invalid custom command type: {command_dict["type"]}'
             self.client.logger.error(msg)
             raise ValueError(msg)
@@ -99,7 +251,15 @@ class Space(abc.ABC):
         value = command_dict['value']
 
         if command_dict['type'] == 'simple':
-            self.custom_command_dict[name] = CommandSimple(name=name, author=author, creation_time=crtime, modification_time=mtime, value=value)
+            # the value is read back from storage when the command is first used
+            command = CommandSimple(name=name, author=author, creation_time=crtime, modification_time=mtime, value=value if resident else None, space=self)
+            CommandSimple.value_cache.pop(command)
+            self.add_command(command)
+        elif command_dict['type'] == 'template':
+            command = CommandTemplate(name=name, author=author, creation_time=crtime, modification_time=mtime, value=value if resident else None, space=self)
+            CommandSimple.value_cache.pop(command)
+            CommandTemplate.compiled_cache.pop(command)
+            self.add_command(command)
         else:
             # command_type must equal 'alias'
             if value in self.client.builtin_command_dict:
@@ -109,16 +269,18 @@ class Space(abc.ABC):
             else:
                 self.client.logger.warning(f'cant add alias before its target. name: {name}, value: {value}')
                 return False
-            self.custom_command_dict[name] = CommandAlias(name=name, author=author, creation_time=crtime, modification_time=mtime, value=value, builtin=False)
+            self.add_command(CommandAlias(name=name, author=author, creation_time=crtime, modification_time=mtime, value=value, builtin=False))
         return True
 
-    def load_commands(self, command_dict_list: List[Dict[str, Any]]) -> bool:
+    # misplaced: names of commands stored in a file not named after them
+    def load_commands(self, command_dict_list: List[Dict[str, Any]], misplaced: Iterable[str] = ()) -> bool:
+        misplaced = frozenset(misplaced)
         failed_all = False
         commands_to_add = command_dict_list[:]
         while len(commands_to_add) > 0 and not failed_all:
             failed_all = True
             for command_dict in commands_to_add[:]:
-                if self.load_command(command_dict):
+                if self.load_command(command_dict, resident=command_dict['name'] in misplaced):
                     commands_to_add.remove(command_dict)
                     failed_all = False
         if failed_all:
@@ -139,8 +301,11 @@ class Space(abc.ABC):
             return int(match.group(1))
 
         # username input
+        userlist = await self.get_query_candidates(query)
+        return self.match_users(query, userlist)
+
+    def match_users(self, query: str, userlist: Iterable[discord.abc.User]) -> int:
         user_id = -1
-        userlist = await self.get_userlist()
         query = query.lower()
         for user in frozenset({self.client.user}).union(userlist):
             fullname = user.name.lower() + '#' + user.discriminator
@@ -151,6 +316,10 @@ class Space(abc.ABC):
                 user_id = user.id
         return user_id
 
+    # users that might match a name query
+    async def get_query_candidates(self, query: str) -> FrozenSet[discord.abc.User]:
+        return await self.get_userlist()
+
     @abc.abstractmethod
     async def get_userlist(self) -> FrozenSet[discord.abc.User]:
         pass
@@ -159,6 +328,66 @@ class Space(abc.ABC):
     def is_moderator(self, user: discord.abc.User) -> bool:
         pass
 
+class CommandBatch:
+
+    # changes to the commands of a space that are applied in memory together
+    # then saved in one go, and undone if saving fails
+    def __init__(self, space: Space):
+        self.space = space
+        self.removed: Dict[str, Command] = OrderedDict()
+        self.authors: Dict[str, Optional[int]] = {}
+
+    # aliases are removed with their target
+    def remove(self, name: str):
+        pending = [name]
+        while pending:
+            command = self.space.custom_command_dict[pending.pop()]
+            if command.name in self.removed:
+                continue
+            self.removed[command.name] = command
+            pending.extend(alias.name for alias in command.aliases)
+
+    def set_author(self, name: str, author: Optional[int]):
+        self.authors[name] = author
+
+    def names(self) -> List[str]:
+        return list(self.removed) + [name for name in self.authors if name not in self.removed]
+
+    # storage is changed first, and memory only once that worked
+    async def commit(self) -> bool:
+        space = self.space
+        now = int(time.time())
+        changed = [space.custom_command_dict[name] for name in self.authors if name not in self.removed]
+        command_dicts = {}
+        for command in changed:
+            if isinstance(command, CommandSimple):
+                # read off the event loop, so get_dict() finds it in the cache
+                await command.get_value()
+            command_dicts[command.name] = {**command.get_dict(), 'author': self.authors[command.name], 'mtime': now}
+        try:
+            saved = await asyncio.get_running_loop().run_in_executor(None, space.save_commands, command_dicts, list(self.removed))
+        except IOError:
+            space.client.logger.exception(f'Unable to undo a failed save, reloading space: {space.space_id}')
+            saved = None
+        for name in self.names():
+            space.client.storage_written(space.command_path(name))
+        if saved is None:
+            # the caller holds the lock
+            await space.client._reload_space0(space.space_id) # pylint: disable=protected-access
+            return False
+        if not saved:
+            return False
+        for command in changed:
+            command.author = self.authors[command.name]
+            command.modification_time = now
+            if isinstance(command, CommandSimple):
+                command.unload_value()
+        for name, command in self.removed.items():
+            if isinstance(command, CommandAlias):
+                command.follow().remove_alias(command)
+            space.delete_command(name)
+        return True
+
 class DMSpace(Space):
 
     def __init__(self, client: DeepBlueSky, base_id: int):
@@ -231,3 +460,9 @@ class GuildSpace(Space):
 
     async def get_userlist(self) -> FrozenSet[discord.abc.User]:
         return frozenset((await self.get_guild()).members)
+
+    async def get_query_candidates(self, query: str) -> FrozenSet[discord.abc.User]:
+        guild = await self.get_guild()
+        if guild.chunked or self.client.chunk_guilds_at_startup:
+            return frozenset(guild.members)
+        return await self.client.query_guild_members(guild, query)
@@ -0,0 +1,65 @@
+# startup.py
+# startup timeline and deferred imports
+from __future__ import annotations
+
+import contextlib
+import importlib
+import logging
+import sys
+import time
+
+from types import ModuleType
+from typing import Iterator, List, Optional, Tuple
+
+class StartupTimeline:
+
+    def __init__(self):
+        self.origin: float = time.perf_counter()
+        # (name, seconds since origin, duration in seconds if measured)
+        self.events: List[Tuple[str, float, Optional[float]]] = []
+        self.reported: int = 0
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.origin
+
+    def has(self, name: str) -> bool:
+        return any(event[0] == name for event in self.events)
+
+    def mark(self, name: str):
+        self.events.append((name, self.elapsed(), None))
+
+    def mark_once(self, name: str):
+        if not self.has(name):
+            self.mark(name)
+
+    @contextlib.contextmanager
+    def measure(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.events.append((name, end - self.origin, end - start))
+
+    # only report the events that have not yet been logged
+    def report(self, logger: logging.Logger):
+        for name, at, duration in self.events[self.reported:]:
+            if duration is None:
+                logger.info(f'Startup: +{at:.3f}s {name}')
+            else:
+                logger.info(f'Startup: +{at:.3f}s {name} ({1000 * duration:.1f} ms)')
+        self.reported = len(self.events)
+
+timeline = StartupTimeline()
+
+# for modules that only a few rarely used commands need
+def lazy_import(module_name: str) -> ModuleType:
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    with timeline.measure(f'import {module_name} (deferred)'):
+        module = importlib.import_module(module_name)
+    # the startup report has already gone out, so log this one by itself
+    if timeline.reported:
+        timeline.report(logging.getLogger('discord'))
+    return module
@@ -2,34 +2,96 @@
 # varous text processing stuff here
 from __future__ import annotations
 
+import functools
 import re
 
-from typing import Any
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 def identity(arg: Any) -> Any:
     return arg
 
+_OWO_TABLE = str.maketrans('rlRL', 'wwWW')
+# inserts the y, so there is no group to copy
+_OWO_NY_PATTERN = re.compile(r'(?<=[Nn])(?=[AEIOUYaeiouy])')
+
 def owoify(text: str) -> str:
-    text = re.sub(r'r{1,2}|l{1,2}', 'w', text)
-    text = re.sub(r'R{1,2}|L{1,2}', 'W', text)
-    text = re.sub(r'([Nn])(?=[AEIOUYaeiouy])', r'\1y', text)
-    return text
+    # str.replace pairs letters up left to right, just like r{1,2} would,
+    # so each pair and each leftover single letter becomes one w
+    text = text.replace('rr', 'r').replace('ll', 'l').replace('RR', 'R').replace('LL', 'L')
+    return _OWO_NY_PATTERN.sub('y', text.translate(_OWO_TABLE))
 
 def spongebob(text: str) -> str:
-    total = ''
+    total: List[str] = []
     upper = False
     for char in text.lower():
         # space characters and the like are not
         # lowercase even if the string is lowercase
         if char.islower():
-            if upper:
-                total += char.upper()
-            else:
-                total += char
+            total.append(char.upper() if upper else char)
             upper = not upper
         else:
-            total += char
-    return total
+            total.append(char)
+    return ''.join(total)
+
+_SMALLCAPS_TABLE = str.maketrans('abcdefghijklmnopqrstuvwxyz', 'ᴀʙᴄᴅᴇꜰɢʜɪᴊᴋʟᴍɴᴏᴘǫʀꜱᴛᴜᴠᴡxʏᴢ')
+# printable ASCII to the fullwidth forms block
+_FULLWIDTH_TABLE = {**{codepoint: codepoint + 0xFEE0 for codepoint in range(0x21, 0x7F)}, 0x20: 0x3000}
+
+# transforms that can be chained in a pipeline, by name
+TRANSFORMS: Dict[str, Callable[[str], str]] = {
+    'owo': owoify,
+    'spongebob': spongebob,
+    'upper': str.upper,
+    'lower': str.lower,
+    'reverse': lambda text: text[::-1],
+    'smallcaps': lambda text: text.lower().translate(_SMALLCAPS_TABLE),
+    'fullwidth': lambda text: text.translate(_FULLWIDTH_TABLE),
+}
+
+class Pipeline:
+
+    def __init__(self, names: Tuple[str, ...]):
+        self.names = names
+        self.steps = tuple(TRANSFORMS[name] for name in names)
+
+    def __call__(self, text: str) -> str:
+        for step in self.steps:
+            text = step(text)
+        return text
+
+    def __str__(self) -> str:
+        return '|'.join(self.names)
+
+# e.g. 'owo|spongebob', compiled once per distinct spec
+@functools.lru_cache(maxsize=256)
+def compile_pipeline(spec: str) -> Pipeline:
+    names = tuple(name.strip().lower() for name in spec.split('|'))
+    unknown = [name for name in names if name not in TRANSFORMS]
+    if unknown:
+        raise ValueError(f'Unknown transform: {unknown[0]}')
+    return Pipeline(names)
+
+# discord rejects messages longer than this
+MESSAGE_LIMIT = 2000
+
+# prefers to break at newlines, then at spaces
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    chunks: List[str] = []
+    while len(text) > limit:
+        cut: Optional[int] = None
+        for separator in ('\n', ' '):
+            index = text.rfind(separator, 0, limit + 1)
+            if index > 0:
+                cut = index
+                break
+        if cut is None:
+            chunks.append(text[:limit])
+            text = text[limit:]
+        else:
+            chunks.append(text[:cut])
+            text = text[cut + 1:]
+    chunks.append(text)
+    return chunks
 
 def removeprefix(base: str, prefix: str) -> str:
     try:
@@ -51,3 +113,43 @@ def removesuffix(base: str, suffix: str) -> str:
 
 def pluralize(count: int, singular: str, plural: Optional[str] = None) -> str:
     return singular if count == 1 else plural if plural is not None else singular + 's'
+
+# templates are parsed into literal strings and (placeholder, index) pairs
+# {args}: everything after the command name
+# {1}, {2}, ...: a single argument, empty if there are not that many
+# {author}: a mention of whoever called the command
+# {time}: the current time, shown to each reader in their own time zone
+# {{ and }} are literal braces
+TEMPLATE_PLACEHOLDERS = ('args', 'author', 'time')
+TEMPLATE_MAX_INDEX = 99
+
+_TEMPLATE_TOKEN = re.compile(r'\{\{|\}\}|\{([^{}]*)\}')
+
+TemplatePart = Union[str, Tuple[str, int]]
+
+def compile_template(source: str) -> Tuple[TemplatePart, ...]:
+    parts: List[TemplatePart] = []
+    literal: List[str] = []
+    position = 0
+    for match in _TEMPLATE_TOKEN.finditer(source):
+        literal.append(source[position:match.start()])
+        position = match.end()
+        token = match.group()
+        if token in ('{{', '}}'):
+            literal.append(token[0])
+            continue
+        name = match.group(1).strip().lower()
+        if name.isdigit() and 1 <= int(name) <= TEMPLATE_MAX_INDEX:
+            placeholder = ('arg', int(name))
+        elif name in TEMPLATE_PLACEHOLDERS:
+            placeholder = (name, 0)
+        else:
+            raise ValueError(f'Unknown placeholder: `{token}`')
+        if any(literal):
+            parts.append(''.join(literal))
+        literal = []
+        parts.append(placeholder)
+    literal.append(source[position:])
+    if any(literal):
+        parts.append(''.join(literal))
+    return tuple(parts)
@@ -0,0 +1,122 @@
+# timeparse.py
+# converting the time strings people type to datetimes
+# the common shapes are matched directly, anything else goes to dateutil
+from __future__ import annotations
+
+import datetime
+import functools
+import re
+import warnings
+
+from typing import Dict, Optional
+
+from .startup import lazy_import
+
+class UnknownTimezoneError(ValueError):
+    pass
+
+# common abbreviations, some of which are ambiguous
+# (IST is taken to be India, CST North America)
+_ABBREVIATIONS = {
+    'UTC': 0, 'GMT': 0, 'Z': 0, 'WET': 0, 'WEST': 60, 'BST': 60, 'CET': 60, 'CEST': 120,
+    'EET': 120, 'EEST': 180, 'MSK': 180, 'IST': 330, 'PKT': 300, 'ICT': 420, 'WIB': 420,
+    'SGT': 480, 'HKT': 480, 'AWST': 480, 'PHT': 480, 'JST': 540, 'KST': 540, 'ACST': 570,
+    'ACDT': 630, 'AEST': 600, 'AEDT': 660, 'NZST': 720, 'NZDT': 780, 'HST': -600,
+    'AKST': -540, 'AKDT': -480, 'PST': -480, 'PDT': -420, 'MST': -420, 'MDT': -360,
+    'CST': -360, 'CDT': -300, 'EST': -300, 'EDT': -240, 'AST': -240, 'ADT': -180,
+    'NST': -210, 'NDT': -150, 'BRT': -180, 'ART': -180,
+}
+
+@functools.lru_cache(maxsize=None)
+def timezone_table() -> Dict[str, datetime.timezone]:
+    return {name: datetime.timezone(datetime.timedelta(minutes=minutes), name) for name, minutes in _ABBREVIATIONS.items()}
+
+def _offset_pattern(prefix: str) -> str:
+    return rf'(?P<{prefix}sign>[+-])(?P<{prefix}offset_hours>\d{{1,2}})(?::?(?P<{prefix}offset_minutes>\d{{2}}))?'
+
+# an abbreviation with an optional offset, like UTC+3, or a bare offset, like +03:00
+_ZONE = rf'(?:(?P<zone>[A-Za-z]{{1,5}})\s*(?:{_offset_pattern("")})?|{_offset_pattern("bare_")})'
+
+_UNIX_PATTERN = re.compile(r'@?(?P<seconds>-?\d{9,11}(?:\.\d+)?)')
+_ISO_PATTERN = re.compile(r'(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})'
+    r'(?:[T ](?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2})(?:[.,](?P<fraction>\d{1,6})\d*)?)?)?'
+    rf'\s*{_ZONE}?', re.IGNORECASE)
+_CLOCK_PATTERN = re.compile(r'(?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}))?\s*(?P<meridiem>[ap]\.?m\.?)?'
+    rf'\s*{_ZONE}?', re.IGNORECASE)
+
+# None if the abbreviation is unknown, so dateutil gets a go at it
+def _zone(match: re.Match) -> Optional[datetime.timezone]:
+    zone = match.group('zone')
+    if zone:
+        tzinfo = timezone_table().get(zone.upper())
+        if tzinfo is None:
+            return None
+        prefix = ''
+    else:
+        tzinfo = datetime.timezone.utc
+        prefix = 'bare_'
+    sign = match.group(f'{prefix}sign')
+    if not sign:
+        return tzinfo
+    offset = datetime.timedelta(hours=int(match.group(f'{prefix}offset_hours')), minutes=int(match.group(f'{prefix}offset_minutes') or 0))
+    # UTC+3 is three hours ahead of UTC, as is +03:00
+    return datetime.timezone(tzinfo.utcoffset(None) + (offset if sign == '+' else -offset))
+
+def _parse_fast(text: str, now: datetime.datetime) -> Optional[datetime.datetime]:
+    match = _UNIX_PATTERN.fullmatch(text)
+    if match:
+        return datetime.datetime.fromtimestamp(float(match.group('seconds')), tz=datetime.timezone.utc)
+    match = _ISO_PATTERN.fullmatch(text)
+    if match:
+        tzinfo = _zone(match)
+        if tzinfo is None:
+            return None
+        fraction = match.group('fraction') or '0'
+        return datetime.datetime(int(match.group('year')), int(match.group('month')), int(match.group('day')),
+            int(match.group('hour') or 0), int(match.group('minute') or 0), int(match.group('second') or 0),
+            int(fraction.ljust(6, '0')), tzinfo=tzinfo)
+    match = _CLOCK_PATTERN.fullmatch(text)
+    if match:
+        tzinfo = _zone(match)
+        if tzinfo is None:
+            return None
+        hour = int(match.group('hour'))
+        meridiem = match.group('meridiem')
+        if meridiem:
+            if not 1 <= hour <= 12:
+                raise ValueError(text)
+            hour = hour % 12 + (12 if meridiem[0].lower() == 'p' else 0)
+        # today, as far as that time zone is concerned
+        today = now.astimezone(tzinfo)
+        return today.replace(hour=hour, minute=int(match.group('minute')), second=int(match.group('second') or 0), microsecond=0)
+    return None
+
+# dateutil reads UTC+3 the POSIX way, as three hours behind UTC
+_POSIX_SIGN = re.compile(r'(?<=[A-Za-z])\s*([+-])')
+
+def _parse_dateutil(text: str) -> datetime.datetime:
+    dateutil_parser = lazy_import('dateutil.parser')
+    text = _POSIX_SIGN.sub(lambda match: '-' if match.group(1) == '+' else '+', text)
+    with warnings.catch_warnings():
+        warnings.filterwarnings('error')
+        try:
+            return dateutil_parser.parse(text, tzinfos=timezone_table())
+        except dateutil_parser.UnknownTimezoneWarning as ex:
+            raise UnknownTimezoneError(text) from ex
+        except (dateutil_parser.ParserError, OverflowError) as ex:
+            raise ValueError(text) from ex
+
+# raises UnknownTimezoneError or ValueError
+# times without a zone are UTC
+def parse_time(text: str, now: Optional[datetime.datetime] = None) -> datetime.datetime:
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+    text = text.strip()
+    if not text or text.lower() == 'now':
+        return now
+    dt = _parse_fast(text, now)
+    if dt is None:
+        dt = _parse_dateutil(text)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt
@@ -0,0 +1,203 @@
+# usage.py
+# how often, and how recently, each command in each space is called
+# counted in memory and flushed to storage now and then
+# each process of a sharded bot writes its own file, and they are merged on load
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import glob
+import logging
+import os
+import time
+
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .backends import dump_json, load_json
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None # type: ignore
+
+# several shard processes can prune the same stale file at once
+@contextlib.contextmanager
+def _file_lock(filename: str) -> Iterator[None]:
+    if fcntl is None:
+        yield
+        return
+    with open(filename, 'a', encoding='UTF-8') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+class UsageStore:
+
+    # usage.json for the whole bot, usage.<shard ids>.json for some of its shards
+    def __init__(self, logger: logging.Logger, basename: str = 'usage', shard_ids: Optional[Sequence[int]] = None, flush_interval: float = 300.0):
+        self.logger = logger
+        self.basename = basename
+        self.shard_ids = frozenset(shard_ids) if shard_ids is not None else None
+        self.filename = f'{basename}.json' if shard_ids is None else f'{basename}.{"_".join(str(shard_id) for shard_id in shard_ids)}.json'
+        self.flush_interval = flush_interval
+        # space_id -> command name -> [calls, last used]
+        self.usage: Dict[str, Dict[str, List[int]]] = {}
+        self.dirty = False
+        # files left over from a different split of the shards, and which spaces in them now belong here
+        self.stale_files: List[str] = []
+        self.owns_space: Optional[Callable[[str], bool]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, space_id: str, command_name: str):
+        space_usage = self.usage.setdefault(space_id, {})
+        entry = space_usage.get(command_name)
+        if entry is None:
+            space_usage[command_name] = [1, int(time.time())]
+        else:
+            entry[0] += 1
+            entry[1] = int(time.time())
+        self.dirty = True
+
+    def forget(self, space_id: str, command_name: str):
+        if self.usage.get(space_id, {}).pop(command_name, None) is not None:
+            self.dirty = True
+
+    # (name, calls, last used), most called first
+    def top_commands(self, space_id: str, limit: int = 10) -> List[Tuple[str, int, int]]:
+        space_usage = self.usage.get(space_id, {})
+        ranked = sorted(space_usage.items(), key=lambda item: (-item[1][0], -item[1][1]))
+        return [(name, calls, last_used) for name, (calls, last_used) in ranked[:limit]]
+
+    # (space_id, name), most called first across every space
+    def hottest(self, limit: int) -> List[Tuple[str, str]]:
+        ranked = sorted(((calls, space_id, name) for space_id, space_usage in self.usage.items() for name, (calls, _) in space_usage.items()), reverse=True)
+        return [(space_id, name) for _, space_id, name in ranked[:limit]]
+
+    # usage.json belongs to the whole bot, usage.<shard ids>.json to the process running those shards
+    # a file is stale if it shares shards with this process without being its own,
+    # the processes it belonged to are gone and their spaces now belong to the current ones
+    def is_stale(self, filename: str) -> bool:
+        if filename == self.filename:
+            return False
+        if self.shard_ids is None:
+            return True
+        shard_list = os.path.basename(filename)[len(self.basename) + 1:-len('.json')]
+        if not shard_list:
+            return True
+        try:
+            file_shard_ids = {int(shard_id) for shard_id in shard_list.split('_')}
+        except ValueError:
+            return False
+        return not file_shard_ids.isdisjoint(self.shard_ids)
+
+    # reads every usage file, as spaces move between files when the shards are split up differently
+    # each space is only counted by one process at a time, and the counts only go up,
+    # so the largest count is the most recent one
+    def load(self, owns_space: Optional[Callable[[str], bool]] = None) -> bool:
+        filenames = glob.glob(glob.escape(self.basename) + '.json') + glob.glob(glob.escape(self.basename) + '.*.json')
+        usage: Dict[str, Dict[str, List[int]]] = {}
+        success = True
+        for filename in sorted(filenames):
+            try:
+                with open(filename, 'r', encoding='UTF-8') as json_file:
+                    file_usage = load_json(json_file)
+            except FileNotFoundError:
+                continue
+            except (IOError, ValueError):
+                self.logger.exception(f'Unable to load command usage: {filename}')
+                success = False
+                continue
+            for space_id, file_space_usage in file_usage.items():
+                if owns_space is not None and not owns_space(space_id):
+                    continue
+                space_usage = usage.setdefault(space_id, {})
+                for name, (calls, last_used) in file_space_usage.items():
+                    entry = space_usage.get(name)
+                    if entry is None:
+                        space_usage[name] = [calls, last_used]
+                    else:
+                        entry[0] = max(entry[0], calls)
+                        entry[1] = max(entry[1], last_used)
+        self.usage = usage
+        self.owns_space = owns_space
+        self.stale_files = [filename for filename in sorted(filenames) if self.is_stale(filename)]
+        # counts that came from another file are written to this one
+        self.dirty = any(filename != self.filename for filename in filenames)
+        return success and bool(filenames)
+
+    # a copy that can be written out while the event loop keeps counting
+    def snapshot(self) -> Dict[str, Dict[str, List[int]]]:
+        return {space_id: {name: list(entry) for name, entry in space_usage.items()} for space_id, space_usage in self.usage.items()}
+
+    def write(self, usage: Dict[str, Dict[str, List[int]]]) -> bool:
+        try:
+            with open(f'{self.filename}.tmp', 'w', encoding='UTF-8') as json_file:
+                dump_json(usage, json_file)
+            os.replace(f'{self.filename}.tmp', self.filename)
+        except IOError:
+            self.dirty = True
+            self.logger.exception('Unable to save command usage')
+            return False
+        # only once the counts are safe in this file, so a crash cannot lose them
+        if self.stale_files:
+            self.prune_stale_files()
+        return True
+
+    # takes the spaces this process owns out of stale files, so a count that was forgotten here
+    # does not come back from them the next time the shards are split up differently
+    # the other processes that shared the stale file remove their own spaces from it the same way
+    def prune_stale_files(self):
+        remaining = []
+        with _file_lock(f'{self.basename}.lock'):
+            for filename in self.stale_files:
+                try:
+                    with open(filename, 'r', encoding='UTF-8') as json_file:
+                        file_usage = load_json(json_file)
+                    kept = {space_id: space_usage for space_id, space_usage in file_usage.items() if self.owns_space is not None and not self.owns_space(space_id)}
+                    if not kept:
+                        os.remove(filename)
+                    elif len(kept) < len(file_usage):
+                        with open(f'{filename}.tmp', 'w', encoding='UTF-8') as json_file:
+                            dump_json(kept, json_file)
+                        os.replace(f'{filename}.tmp', filename)
+                except FileNotFoundError:
+                    continue
+                except (IOError, ValueError):
+                    self.logger.exception(f'Unable to prune stale command usage: {filename}')
+                    remaining.append(filename)
+        self.stale_files = remaining
+
+    def flush(self) -> bool:
+        if not self.dirty:
+            return True
+        self.dirty = False
+        return self.write(self.snapshot())
+
+    # the copy is taken on the event loop, the file is written in the executor
+    async def flush_in_executor(self) -> bool:
+        if not self.dirty:
+            return True
+        self.dirty = False
+        return await asyncio.get_running_loop().run_in_executor(None, self.write, self.snapshot())
+
+    def start(self):
+        if self._task:
+            return
+        self._task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush_in_executor()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush_in_executor()
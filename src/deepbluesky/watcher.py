@@ -0,0 +1,261 @@
+# watcher.py
+# reload spaces whose files under storage/ were changed by something other than the bot
+# with inotify where it is available, and by scanning storage/ now and then where it is not
+from __future__ import annotations
+
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import struct
+
+from typing import TYPE_CHECKING, Dict, Optional, Set, Tuple
+
+from .cache import LRUCache
+
+if TYPE_CHECKING:
+    from .deepbluesky import DeepBlueSky
+
+FileSignature = Optional[Tuple[int, int, int]]
+
+def file_signature(path: str) -> FileSignature:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+# space_id -> the paths in it, and their signatures
+def scan_storage(root: str) -> Dict[str, Dict[str, FileSignature]]:
+    snapshot: Dict[str, Dict[str, FileSignature]] = {}
+    for space_entry in os.scandir(root):
+        if not space_entry.is_dir():
+            continue
+        files: Dict[str, FileSignature] = {}
+        paths = [f'{space_entry.path}/space.json']
+        try:
+            paths += [entry.path for entry in os.scandir(f'{space_entry.path}/commands') if entry.name.endswith('.json')]
+        except FileNotFoundError:
+            pass
+        for path in paths:
+            signature = file_signature(path)
+            if signature is not None:
+                files[path] = signature
+        snapshot[space_entry.name] = files
+    return snapshot
+
+# from <sys/inotify.h>
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_Q_OVERFLOW = 0x4000
+_IN_IGNORED = 0x8000
+_IN_ISDIR = 0x40000000
+_IN_MASK = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+_EVENT_HEADER = struct.Struct('iIII')
+
+class Inotify:
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            raise OSError(errno.ENOSYS, 'libc not found')
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+    def add_watch(self, path: str, mask: int = _IN_MASK) -> int:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()), path)
+        return wd
+
+    # (wd, mask, name) for each event waiting to be read
+    def read_events(self):
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset+length].rstrip(b'\0'))
+            offset += length
+            yield (wd, mask, name)
+
+    def close(self):
+        os.close(self.fd)
+
+class StorageWatcher:
+
+    # changes are collected for `debounce` seconds, so a script writing
+    # many files in a row causes one reload per space
+    def __init__(self, client: DeepBlueSky, logger: logging.Logger, root: str = 'storage', debounce: float = 0.5, poll_interval: float = 10.0):
+        self.client = client
+        self.logger = logger
+        self.root = root
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        # what the bot last wrote to each path, None if it removed it
+        self.own_writes = LRUCache(maxsize=16384)
+        # space_id -> paths changed since the last reload
+        self.changed: Dict[str, Set[str]] = {}
+        self.inotify: Optional[Inotify] = None
+        # wd -> (space_id, directory), with no space_id for the root
+        self.watches: Dict[int, Tuple[Optional[str], str]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._reload_handle: Optional[asyncio.TimerHandle] = None
+        self._reload_task: Optional[asyncio.Task] = None
+
+    def written(self, path: str):
+        self.own_writes.put(path, file_signature(path))
+
+    def start(self):
+        if self._task or self.inotify:
+            return
+        try:
+            self.inotify = Inotify()
+            self._watch(None, self.root)
+            for space_entry in os.scandir(self.root):
+                if space_entry.is_dir():
+                    self._watch_space(space_entry.name)
+        except OSError as ex:
+            # usually the limit on watches, or not linux
+            self.logger.warning(f'Cannot watch storage with inotify, polling every {self.poll_interval:g} seconds instead: {ex}')
+            if self.inotify:
+                self.inotify.close()
+                self.inotify = None
+                self.watches.clear()
+            self._task = asyncio.create_task(self._poll())
+            return
+        asyncio.get_running_loop().add_reader(self.inotify.fd, self._read_events)
+        self.logger.info(f'Watching storage with inotify, {len(self.watches)} directories')
+
+    async def stop(self):
+        if self._reload_handle:
+            self._reload_handle.cancel()
+            self._reload_handle = None
+        if self.inotify:
+            asyncio.get_running_loop().remove_reader(self.inotify.fd)
+            self.inotify.close()
+            self.inotify = None
+            self.watches.clear()
+        # a reload already under way is let finish, the changes still waiting are dropped
+        if self._reload_task:
+            await asyncio.wait([self._reload_task])
+            self._reload_task = None
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _watch(self, space_id: Optional[str], path: str):
+        self.watches[self.inotify.add_watch(path)] = (space_id, path)
+
+    def _watch_space(self, space_id: str):
+        self._watch(space_id, f'{self.root}/{space_id}')
+        if os.path.isdir(f'{self.root}/{space_id}/commands'):
+            self._watch(space_id, f'{self.root}/{space_id}/commands')
+
+    def _read_events(self):
+        for wd, mask, name in self.inotify.read_events():
+            if mask & _IN_Q_OVERFLOW:
+                self.logger.warning('Storage watcher missed events, reloading every space')
+                for space_entry in os.scandir(self.root):
+                    if space_entry.is_dir():
+                        self._changed(space_entry.name, space_entry.path)
+                continue
+            if mask & _IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches:
+                continue
+            space_id, directory = self.watches[wd]
+            path = f'{directory}/{name}'
+            if mask & _IN_ISDIR:
+                if not mask & (_IN_CREATE | _IN_MOVED_TO):
+                    continue
+                # files written before the watch existed are picked up by looking at the whole directory
+                try:
+                    if space_id is None:
+                        self._watch_space(name)
+                        self._changed(name, path)
+                    elif name == 'commands':
+                        self._watch(space_id, path)
+                        self._changed(space_id, path)
+                except OSError:
+                    self.logger.exception(f'Cannot watch storage directory: {path}')
+                continue
+            if space_id is None or mask & _IN_CREATE or not name.endswith('.json'):
+                continue
+            self._changed(space_id, path)
+
+    def _changed(self, space_id: str, path: str):
+        self.changed.setdefault(space_id, set()).add(path)
+        if self._reload_handle is None:
+            self._reload_handle = asyncio.get_running_loop().call_later(self.debounce, self._schedule_reload)
+
+    # a reload still running when the next one is due is waited for, so the same space is never reloaded twice at once
+    def _schedule_reload(self):
+        self._reload_handle = None
+        previous = self._reload_task if self._reload_task and not self._reload_task.done() else None
+        self._reload_task = asyncio.create_task(self._reload_after(previous))
+
+    async def _reload_after(self, previous: Optional[asyncio.Task]):
+        if previous:
+            await asyncio.wait([previous])
+        await self.reload_changed()
+
+    def _expand(self, path: str) -> Set[str]:
+        if not os.path.isdir(path):
+            return {path}
+        if os.path.basename(path) != 'commands':
+            return {f'{path}/space.json'} | self._expand(f'{path}/commands')
+        return {f'{path}/{name}' for name in os.listdir(path) if name.endswith('.json')}
+
+    def is_own_write(self, path: str) -> bool:
+        recorded = self.own_writes.get(path, ())
+        return recorded != () and recorded == file_signature(path)
+
+    async def reload_changed(self):
+        changed, self.changed = self.changed, {}
+        for space_id, paths in changed.items():
+            try:
+                paths = {expanded for path in paths for expanded in self._expand(path)}
+            except OSError:
+                pass
+            foreign = [path for path in paths if not self.is_own_write(path)]
+            if not foreign:
+                continue
+            self.logger.info(f'Storage changed outside the bot: {", ".join(sorted(foreign)[:5])}{"..." if len(foreign) > 5 else ""}')
+            try:
+                await self.client.reload_space(space_id)
+            except Exception: # pylint: disable=broad-except
+                self.logger.exception(f'Unable to reload space: {space_id}')
+
+    async def _poll(self):
+        loop = asyncio.get_running_loop()
+        previous = await loop.run_in_executor(None, scan_storage, self.root)
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            current = await loop.run_in_executor(None, scan_storage, self.root)
+            for space_id in previous.keys() | current.keys():
+                before = previous.get(space_id, {})
+                after = current.get(space_id, {})
+                for path in before.keys() | after.keys():
+                    if before.get(path) != after.get(path):
+                        self.changed.setdefault(space_id, set()).add(path)
+            previous = current
+            if self.changed:
+                await self.reload_changed()
@@ -3,11 +3,13 @@
 from __future__ import annotations
 
 import re
+import time
 
 from typing import Optional
 from typing import List, Tuple
 
-import requests
+from .metrics import wiki_latency, wiki_lookups
+from .startup import lazy_import
 
 def relative_to_absolute_location(location: str, query_url: str) -> str:
     query_url = re.sub(r'\?.*$', '', query_url)
@@ -18,7 +20,16 @@ def relative_to_absolute_location(location: str, query_url: str) -> str:
         return location
     return re.sub(r'^(([^/]*/)+)[^/]*', r'\1', query_url) + '/' + location
 
-def lookup_tvtropes(article: str) -> Tuple[bool, str]:
+# what is left of a lookup's time, for its next request
+def _remaining(deadline: float) -> float:
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        requests = lazy_import('requests')
+        raise requests.Timeout('Wiki lookup took too long')
+    return remaining
+
+# timeout: for each request, so a host that hangs cannot hold a thread forever
+def lookup_tvtropes(article: str, timeout: float = 10.0) -> Tuple[bool, str]:
     parts = re.sub(r'[^\w/]', '', article).split('/', maxsplit=1)
     if len(parts) > 1:
         namespace = parts[0]
@@ -26,9 +37,18 @@ def lookup_tvtropes(article: str) -> Tuple[bool, str]:
     else:
         namespace = 'Main'
         title = parts[0]
+    requests = lazy_import('requests')
     server = 'https://tvtropes.org'
     query = '/pmwiki/pmwiki.php/' + namespace + '/' + title
-    result = requests.get(server + query, allow_redirects=False)
+    start = time.perf_counter()
+    try:
+        result = requests.get(server + query, allow_redirects=False, timeout=timeout)
+    except requests.RequestException:
+        wiki_lookups.inc('tvtropes', 'error')
+        raise
+    finally:
+        wiki_latency.observe(time.perf_counter() - start, 'tvtropes')
+    wiki_lookups.inc('tvtropes', 'found' if 'location' in result.headers or result.ok else 'missing')
     if 'location' in result.headers:
         location = relative_to_absolute_location(result.headers['location'], server + query)
         return (True, location)
@@ -37,7 +57,8 @@ def lookup_tvtropes(article: str) -> Tuple[bool, str]:
         return (False, result.url)
     return (True, result.url) if result.ok else (False, '')
 
-def lookup_mediawiki(mediawiki_base: str, article: str) -> Optional[str]:
+def lookup_mediawiki(mediawiki_base: str, article: str, timeout: float = 10.0) -> Optional[str]:
+    requests = lazy_import('requests')
     parts = article.split('/')
     parts = [re.sub(r'\s+', r'_', part).strip('_') for part in parts]
     article = '/'.join(parts)
@@ -47,27 +68,39 @@ def lookup_mediawiki(mediawiki_base: str, article: str) -> Optional[str]:
         'ns0': '1',
         'search': article,
     }
-    result = requests.head(mediawiki_base, params=params)
+    backend = re.sub(r'^[a-zA-Z]+://([^/]*).*$', r'\1', mediawiki_base)
+    deadline = time.monotonic() + timeout
+    start = time.perf_counter()
+    try:
+        result = requests.head(mediawiki_base, params=params, timeout=timeout)
+    except requests.RequestException:
+        wiki_lookups.inc(backend, 'error')
+        raise
+    finally:
+        wiki_latency.observe(time.perf_counter() - start, backend)
+    wiki_lookups.inc(backend, 'found' if 'location' in result.headers else 'missing')
     if 'location' in result.headers:
         location = relative_to_absolute_location(result.headers['location'], mediawiki_base)
         if ':' in location[7:]:
             # Location is a user page
-            second_result = requests.head(location)
+            second_result = requests.head(location, timeout=_remaining(deadline))
             # If the user exists but they have no user page, then mediawiki will return 200
             # But the last-modified header only is preset if the user page also exists
             return location if second_result.ok and 'last-modified' in second_result.headers else None
         return location
     return None
 
-def lookup_wikis(article: str, extra_wikis: List[str]) -> str:
+# timeout: for the whole lookup, so its thread is free again by the time the reply says it timed out
+def lookup_wikis(article: str, extra_wikis: List[str], timeout: float = 10.0) -> str:
+    deadline = time.monotonic() + timeout
     for wiki in extra_wikis:
-        wiki_url = lookup_mediawiki(wiki, article)
+        wiki_url = lookup_mediawiki(wiki, article, timeout=_remaining(deadline))
         if wiki_url:
             return wiki_url
-    success, tv_url = lookup_tvtropes(article.strip())
+    success, tv_url = lookup_tvtropes(article.strip(), timeout=_remaining(deadline))
     if success:
         return tv_url
-    wiki_url = lookup_mediawiki('https://en.wikipedia.org/w/index.php', article)
+    wiki_url = lookup_mediawiki('https://en.wikipedia.org/w/index.php', article, timeout=_remaining(deadline))
     if wiki_url:
         return wiki_url
     return f'Inexact Title Disambiguation Page Found:\n{tv_url}' if tv_url else f'Unable to locate article: `{article}`'